@@ -1,6 +1,6 @@
 # app.py
 # 这个文件是Flask应用的主入口,定义了各种路由和API端点
-from flask import Flask, render_template, request, send_file, jsonify, Response
+from flask import Flask, render_template, request, send_file, send_from_directory, jsonify, Response
 from flask_socketio import SocketIO, emit
 import os
 from dotenv import load_dotenv
@@ -12,15 +12,26 @@ from utils import (
     export_to_excel, 
     allowed_file, 
     remove_duplicates,
-    calculate_commute_times  # 添加这个导入
+    calculate_commute_times,  # 添加这个导入
+    TABLE_FORMATS,
+    ORDER_FILE_EXTENSIONS,
+    TABLE_FILE_EXTENSIONS
 )
 import logging
 from docx import Document
 from sqlalchemy import func
 from utils import parse_and_export_orders
+from matching import read_tutors, geocode_missing, load_orders_for_matching, match_tutors
+from search import search_orders, order_to_dict
+from normalize import backfill_typed_fields, time_slot_mask
+from batches import list_batches, batch_to_dict, ensure_batch_summaries
+from profiling import profiling_enabled, profile_run, list_profiles, PROFILES_DIR, PROFILE_MODES
+from functools import wraps
+from pipeline import process_and_export_orders
 import json
 from werkzeug.utils import secure_filename
 import traceback
+from progress import ThrottledProgress
 
 # 确保这行在其他导入之前
 load_dotenv()  # 这行会加载 .env 文件中的环境变量
@@ -44,6 +55,7 @@ logging.basicConfig(filename='order_processing.log', level=logging.INFO,
 
 # 据库初始化
 init_db()
+ensure_batch_summaries()
 
 exports_dir = os.path.join(os.getcwd(), 'exports')
 if not os.path.exists(exports_dir):
@@ -53,34 +65,81 @@ if not os.path.exists(exports_dir):
 def shutdown_session(exception=None):
     db_session.remove()
 
+def is_admin_request():
+    """
+    请求头 X-Admin-Token 与环境变量 ADMIN_TOKEN 一致时视为管理员请求。
+    """
+    admin_token = os.getenv('ADMIN_TOKEN')
+    return bool(admin_token) and request.headers.get('X-Admin-Token') == admin_token
+
+def profiled(view):
+    """
+    允许管理员通过 ?profile=wall|cpu 或请求头 X-Profile 对单个请求进行性能分析。
+    未设置 PROFILING_ENABLED 或请求未要求分析时直接调用原函数。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiling_enabled():
+            return view(*args, **kwargs)
+        mode = request.args.get('profile') or request.headers.get('X-Profile')
+        if mode not in PROFILE_MODES or not is_admin_request():
+            return view(*args, **kwargs)
+        with profile_run(view.__name__, mode):
+            return view(*args, **kwargs)
+    return wrapper
+
+def requested_format(field='format', default='xlsx'):
+    """
+    读取请求中的导出格式参数,不支持的格式返回 None。
+    """
+    file_format = (request.form.get(field) or request.args.get(field) or default).lower()
+    return file_format if file_format in TABLE_FORMATS else None
+
+def read_order_input():
+    """
+    从上传的 Word 文件或文本框中读取订单数据。
+
+    Returns:
+        tuple: (订单数据, 错误信息)。读取成功时错误信息为 None。
+    """
+    input_data = ""
+    if 'file' in request.files and request.files['file'].filename != '':
+        file = request.files['file']
+        if file and allowed_file(file.filename, ORDER_FILE_EXTENSIONS):
+            filename = secure_filename(file.filename)
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            file.save(file_path)
+            logging.info(f"处理文件：{file_path}")
+            
+            # 使用 python-docx 读取 .docx 文件
+            doc = Document(file_path)
+            input_data = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        else:
+            logging.error("无效的文件类型")
+            return None, "无效的文件类型"
+    elif 'order_text' in request.form:
+        input_data = request.form['order_text']
+    
+    if not input_data.strip():
+        logging.error("订单数据为空")
+        return None, "订单数据不能为空"
+    return input_data, None
+
 @app.route('/', methods=['GET', 'POST']) 
+@profiled
 def index():
     if request.method == 'POST':
         try:
-            input_data = ""
-            if 'file' in request.files and request.files['file'].filename != '':
-                file = request.files['file']
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    logging.info(f"处理文件：{file_path}")
-                    
-                    # 使用 python-docx 读取 .docx 文件
-                    doc = Document(file_path)
-                    input_data = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-                else:
-                    logging.error("无效的文件类型")
-                    return "无效的文件类型", 400
-            elif 'order_text' in request.form:
-                input_data = request.form['order_text']
-            
-            if not input_data.strip():
-                logging.error("订单数据为空")
-                return "订单数据不能为空", 400
+            input_data, error = read_order_input()
+            if error:
+                return error, 400
             
             logging.info(f"输入数据长度：{len(input_data)}")
-            result = process_orders(input_data, progress_callback)
+            progress = make_progress_callback()
+            try:
+                result = process_orders(input_data, progress)
+            finally:
+                progress.flush()
             logging.info(f"处理结果：{result}")
             
             return result, 200
@@ -89,10 +148,46 @@ def index():
             return f"处理订单时发生错误：{str(e)}", 500
     return render_template('index.html')
 
+@app.route('/process_and_export', methods=['POST'])
+@profiled
+def process_and_export():
+    try:
+        input_data, error = read_order_input()
+        if error:
+            return jsonify({"error": error}), 400
+        file_format = requested_format()
+        if not file_format:
+            return jsonify({"error": "不支持的导出格式"}), 400
+
+        logging.info(f"流水线模式，输入数据长度：{len(input_data)}")
+        progress = make_progress_callback()
+        try:
+            stats, file_path = process_and_export_orders(input_data, progress, file_format=file_format)
+        finally:
+            progress.flush()
+
+        message = f"入库 {stats['saved']} 个订单（跳过 {stats['duplicates']} 个重复订单），成功解析 {stats['parsed']} 个"
+        return jsonify({"message": message, "file_path": file_path, "stats": stats}), 200
+    except Exception as e:
+        logging.error(f"流水线处理订单时发生错误：{str(e)}")
+        logging.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/parse_and_export', methods=['POST'])
+@profiled
 def parse_and_export():
     try:
-        parsed_count, file_path = parse_and_export_orders(progress_callback)
+        batch_id = request.form.get('batch_id') or (request.get_json(silent=True) or {}).get('batch_id')
+        if batch_id == 'all':
+            batch_id = None
+        file_format = requested_format()
+        if not file_format:
+            return jsonify({"error": "不支持的导出格式"}), 400
+        progress = make_progress_callback()
+        try:
+            parsed_count, file_path = parse_and_export_orders(progress, batch_id, file_format)
+        finally:
+            progress.flush()
         if file_path:
             return jsonify({
                 "message": f"成功解析 {parsed_count} 个订单",
@@ -105,21 +200,104 @@ def parse_and_export():
 
 @app.route('/get_batches', methods=['GET'])
 def get_batches():
-    batches = db_session.query(Order.batch_id, func.count(Order.id).label('count')) \
-                        .group_by(Order.batch_id) \
-                        .all()
-    total_count = sum(batch.count for batch in batches)
-    batch_list = [{'id': 'all', 'count': total_count}] + [{'id': batch.batch_id, 'count': batch.count} for batch in batches]
-    return jsonify(batch_list)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    summary, batch_count, batches = list_batches(page, per_page)
+    return jsonify({
+        "all": dict(id='all', count=summary['total_count'], **summary),
+        "batches": [batch_to_dict(batch) for batch in batches],
+        "total_batches": batch_count,
+        "page": page,
+        "per_page": per_page
+    })
+
+def read_index_list(field, max_value):
+    """
+    读取逗号分隔的序号列表参数,每个序号须为 0 到 max_value 之间的整数。
+
+    Returns:
+        tuple: (序号列表, 错误信息)。参数合法时错误信息为 None。
+    """
+    values = []
+    for item in request.args.get(field, '').split(','):
+        if not item.strip():
+            continue
+        try:
+            value = int(item)
+        except ValueError:
+            return None, f"参数 {field} 必须是逗号分隔的整数"
+        if not 0 <= value <= max_value:
+            return None, f"参数 {field} 的取值范围为 0-{max_value}"
+        values.append(value)
+    return values, None
+
+@app.route('/search', methods=['GET'])
+@profiled
+def search():
+    try:
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        batch_id = request.args.get('batch_id')
+        if batch_id == 'all':
+            batch_id = None
+        # days 和 periods 为逗号分隔的星期序号(0=周一)和时段序号(0=上午,1=下午,2=晚上)
+        days, error = read_index_list('days', 6)
+        if error:
+            return jsonify({"error": error}), 400
+        periods, error = read_index_list('periods', 2)
+        if error:
+            return jsonify({"error": error}), 400
+        time_slots = time_slot_mask(days, periods) if days or periods else None
+
+        total, orders = search_orders(
+            request.args.get('q', ''),
+            batch_id=batch_id,
+            subject=request.args.get('subject'),
+            teacher_gender=request.args.get('teacher_gender'),
+            subject_code=request.args.get('subject_code'),
+            gender_code=request.args.get('gender_code', type=int),
+            min_price=request.args.get('min_price', type=float),
+            max_price=request.args.get('max_price', type=float),
+            time_slots=time_slots,
+            page=page,
+            per_page=per_page
+        )
+        return jsonify({
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "results": [order_to_dict(order) for order in orders]
+        }), 200
+    except Exception as e:
+        logging.error(f"搜索订单时发生错误：{str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/backfill_typed_fields', methods=['POST'])
+def handle_backfill_typed_fields():
+    try:
+        progress = make_progress_callback()
+        try:
+            updated = backfill_typed_fields(progress_callback=progress)
+        finally:
+            progress.flush()
+        return jsonify({"message": f"成功更新 {updated} 个订单的类型化字段", "updated_count": updated}), 200
+    except Exception as e:
+        logging.error(f"补全类型化字段失败：{str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/remove_duplicates', methods=['POST'])
+@profiled
 def handle_remove_duplicates():
     try:
         logging.info("开始执行去重操作")
         total_orders_before = db_session.query(Order).count()
         logging.info(f"去重前订单总数: {total_orders_before}")
 
-        removed_count = remove_duplicates(progress_callback)
+        progress = make_progress_callback()
+        try:
+            removed_count = remove_duplicates(progress)
+        finally:
+            progress.flush()
 
         total_orders_after = db_session.query(Order).count()
         logging.info(f"去重后订单总数: {total_orders_after}")
@@ -148,6 +326,7 @@ def download_file(filename):
         return jsonify({"error": "文件发送失败"}), 500
 
 @app.route('/calculate_commute_times', methods=['POST'])
+@profiled
 def handle_calculate_commute_times():
     try:
         if 'file' not in request.files:
@@ -157,17 +336,31 @@ def handle_calculate_commute_times():
         if file.filename == '':
             return jsonify({"error": "没有选择文件"}), 400
         
-        if file and allowed_file(file.filename):
+        if file and allowed_file(file.filename, TABLE_FILE_EXTENSIONS):
             filename = secure_filename(file.filename)
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(file_path)
             logging.info(f"成功保存上传的文件: {file_path}")
             
-            target_address = request.form.get('target_address')
-            if not target_address:
+            # 支持多个目标地址:可重复提交 target_address 字段,或在一个字段中每行填写一个地址
+            target_addresses = []
+            for value in request.form.getlist('target_address'):
+                for line in value.splitlines():
+                    line = line.strip()
+                    if line and line not in target_addresses:
+                        target_addresses.append(line)
+            if not target_addresses:
                 return jsonify({"error": "未提供目标地址"}), 400
+            output_format = requested_format('output_format', default='xlsx')
+            if not output_format:
+                return jsonify({"error": "不支持的输出格式"}), 400
+            incremental = request.form.get('incremental', '').lower() in ('1', 'true', 'on')
             
-            new_file = calculate_commute_times(file_path, target_address, progress_callback)
+            progress = make_progress_callback()
+            try:
+                new_file = calculate_commute_times(file_path, target_addresses, progress, output_format, incremental)
+            finally:
+                progress.flush()
             
             if os.path.exists(new_file):
                 file_size = os.path.getsize(new_file)
@@ -186,8 +379,88 @@ def handle_calculate_commute_times():
         logging.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
-def progress_callback(progress, message):
-    socketio.emit('progress_update', {'progress': progress, 'message': message})
+@app.route('/match_tutors', methods=['POST'])
+@profiled
+def handle_match_tutors():
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({"error": "没有上传老师信息文件"}), 400
+
+        file = request.files['file']
+        if not allowed_file(file.filename, TABLE_FILE_EXTENSIONS):
+            return jsonify({"error": "不允许的文件类型"}), 400
+
+        filename = secure_filename(file.filename)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file.save(file_path)
+        logging.info(f"成功保存上传的老师信息文件: {file_path}")
+
+        batch_id = request.form.get('batch_id')
+        if batch_id == 'all':
+            batch_id = None
+        max_distance_km = request.form.get('max_distance_km', type=float)
+        price_weight = request.form.get('price_weight', 0.05, type=float)
+
+        progress = make_progress_callback()
+        try:
+            tutors = geocode_missing(read_tutors(file_path), '地址')
+            progress(30, "老师地址解析完成")
+            orders = load_orders_for_matching(batch_id)
+            progress(60, "订单坐标准备完成")
+            results = match_tutors(tutors, orders, price_weight, max_distance_km)
+            progress(90, "匹配完成，正在导出...")
+            export_file = export_to_excel(results, prefix='tutor_matching') if results else None
+            progress(100, "导出完成")
+        finally:
+            progress.flush()
+
+        unlocated_tutors = int(tutors['latitude'].isna().sum())
+        unlocated_orders = int(orders['latitude'].isna().sum())
+        message = f"共 {len(tutors)} 位老师、{len(orders)} 个订单，成功匹配 {len(results)} 对"
+        if unlocated_tutors or unlocated_orders:
+            message += f"（{unlocated_tutors} 位老师、{unlocated_orders} 个订单的地址无法解析，未参与匹配）"
+        return jsonify({
+            "message": message,
+            "matched_count": len(results),
+            "unlocated_tutors": unlocated_tutors,
+            "unlocated_orders": unlocated_orders,
+            "file_path": export_file
+        }), 200
+    except Exception as e:
+        logging.error(f"匹配老师时发生错误: {str(e)}")
+        logging.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    return jsonify(list_profiles())
+
+@app.route('/admin/profiles/<path:filename>', methods=['GET'])
+def download_profile(filename):
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    if not os.path.exists(os.path.join(PROFILES_DIR, secure_filename(filename))):
+        return jsonify({"error": "文件不存在"}), 404
+    return send_from_directory(PROFILES_DIR, secure_filename(filename), as_attachment=True)
+
+def make_progress_callback():
+    """
+    为当前请求创建进度回调,只把进度推送给发起操作的客户端。
+
+    客户端通过请求头 X-Socket-ID 或表单字段 socket_id 传入自己的 Socket.IO 会话ID,
+    未提供时进度只写入日志,不会广播给其他客户端。
+    """
+    sid = request.headers.get('X-Socket-ID') or request.form.get('socket_id')
+
+    def emit_progress(progress, message):
+        if sid:
+            socketio.emit('progress_update', {'progress': progress, 'message': message}, to=sid)
+        else:
+            logging.debug(f"进度 {progress:.0f}%: {message}")
+
+    return ThrottledProgress(emit_progress)
 
 def test_db_connection():
     try:
@@ -0,0 +1,165 @@
+# batches.py
+# 这个文件维护批次汇总表 batches,各处在自己的事务中增量更新计数,由调用方统一提交
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func, case
+
+from database import db_session
+from models import Order, Batch
+
+COUNT_COLUMNS = {
+    'total': Batch.total_count,
+    'parsed': Batch.parsed_count,
+    'failed': Batch.failed_count,
+    'duplicate': Batch.duplicate_count,
+}
+
+
+def record_batch_created(batch_id, order_count):
+    """
+    在当前事务中登记一个新批次。
+    """
+    now = datetime.now()
+    db_session.add(Batch(
+        id=batch_id,
+        total_count=order_count,
+        parsed_count=0,
+        failed_count=0,
+        duplicate_count=0,
+        created_at=now,
+        updated_at=now
+    ))
+
+
+def apply_batch_deltas(deltas):
+    """
+    在当前事务中按增量更新批次计数。
+
+    Args:
+        deltas (dict): {批次ID: {'total'/'parsed'/'failed'/'duplicate': 增量}}。
+    """
+    now = datetime.now()
+    for batch_id, changes in deltas.items():
+        values = {COUNT_COLUMNS[name]: COUNT_COLUMNS[name] + delta
+                  for name, delta in changes.items() if delta}
+        if not values:
+            continue
+        values[Batch.updated_at] = now
+        db_session.query(Batch).filter(Batch.id == batch_id).update(values, synchronize_session=False)
+
+
+def new_deltas():
+    return defaultdict(lambda: defaultdict(int))
+
+
+def order_parsed(order):
+    """
+    订单是否已解析。地址非空的订单离开未解析集合,与 rebuild_batch_summaries
+    和去重时按 address != '' 统计的口径一致。
+    """
+    return bool(order.address)
+
+
+def record_parse_result(deltas, order):
+    """
+    在写入解析字段之后调用,按 order_parsed 判断是否解析成功,
+    更新订单的失败标记并累计批次计数增量。
+
+    Returns:
+        bool: 是否解析成功。
+    """
+    success = order_parsed(order)
+    if success:
+        deltas[order.batch_id]['parsed'] += 1
+        if order.parse_failed:
+            deltas[order.batch_id]['failed'] -= 1
+        order.parse_failed = False
+    elif not order.parse_failed:
+        deltas[order.batch_id]['failed'] += 1
+        order.parse_failed = True
+    return success
+
+
+def rebuild_batch_summaries():
+    """
+    根据 orders 表重新生成全部批次汇总。用于首次启用汇总表时导入已有数据。
+    """
+    try:
+        rows = db_session.query(
+            Order.batch_id,
+            func.count(Order.id),
+            func.sum(case((Order.address != '', 1), else_=0)),
+            func.sum(case((Order.parse_failed == True, 1), else_=0))
+        ).group_by(Order.batch_id).all()
+
+        db_session.query(Batch).delete(synchronize_session=False)
+        now = datetime.now()
+        for batch_id, total, parsed, failed in rows:
+            if batch_id is None:
+                continue
+            db_session.add(Batch(
+                id=batch_id,
+                total_count=total,
+                parsed_count=int(parsed or 0),
+                failed_count=int(failed or 0),
+                duplicate_count=0,
+                created_at=now,
+                updated_at=now
+            ))
+        db_session.commit()
+        logging.info(f"已重建 {len(rows)} 个批次的汇总数据")
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"重建批次汇总时出错：{str(e)}")
+        raise
+
+
+def ensure_batch_summaries():
+    """
+    汇总表为空而 orders 表中已有订单时,导入已有数据。
+    """
+    if Batch.query.first() is None and Order.query.first() is not None:
+        rebuild_batch_summaries()
+
+
+def list_batches(page=1, per_page=50):
+    """
+    分页读取批次汇总,按创建时间倒序。
+
+    Returns:
+        tuple: (所有批次的计数合计, 批次总数, 当前页的批次列表)。
+    """
+    totals = db_session.query(
+        func.count(Batch.id),
+        func.coalesce(func.sum(Batch.total_count), 0),
+        func.coalesce(func.sum(Batch.parsed_count), 0),
+        func.coalesce(func.sum(Batch.failed_count), 0),
+        func.coalesce(func.sum(Batch.duplicate_count), 0)
+    ).one()
+    batch_count = totals[0]
+    summary = {
+        'total_count': int(totals[1]),
+        'parsed_count': int(totals[2]),
+        'failed_count': int(totals[3]),
+        'duplicate_count': int(totals[4]),
+    }
+    batches = Batch.query.order_by(Batch.created_at.desc(), Batch.id.desc()) \
+                         .offset((page - 1) * per_page) \
+                         .limit(per_page) \
+                         .all()
+    return summary, batch_count, batches
+
+
+def batch_to_dict(batch):
+    return {
+        'id': batch.id,
+        'count': batch.total_count,
+        'total_count': batch.total_count,
+        'parsed_count': batch.parsed_count,
+        'failed_count': batch.failed_count,
+        'duplicate_count': batch.duplicate_count,
+        'created_at': batch.created_at.isoformat() if batch.created_at else None,
+        'updated_at': batch.updated_at.isoformat() if batch.updated_at else None,
+    }
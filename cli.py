@@ -0,0 +1,255 @@
+# cli.py
+# 这个文件提供命令行批处理入口,不经过 Web 界面对一个目录中的订单文件执行完整流程:
+# 读取 → 清洗入库 → 去重 → 解析 → 导出 → 计算通勤时间
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial
+
+from docx import Document
+
+from database import init_db, db_session, engine
+from batches import ensure_batch_summaries
+from progress import console_progress
+from profiling import profile_run, PROFILE_MODES
+from utils import (
+    split_orders,
+    clean_data_with_api,
+    save_to_database,
+    remove_duplicates,
+    parse_pending_orders,
+    export_to_excel,
+    calculate_commute_times,
+    log_order_processing,
+    TABLE_FORMATS
+)
+
+INPUT_EXTENSIONS = {'.docx', '.txt'}
+
+
+def read_input_file(file_path):
+    """
+    读取订单文件的文本内容,支持 .docx 和 .txt。
+    """
+    if file_path.lower().endswith('.docx'):
+        doc = Document(file_path)
+        return "\n".join(paragraph.text for paragraph in doc.paragraphs)
+    with open(file_path, encoding='utf-8') as f:
+        return f.read()
+
+
+def find_input_files(input_dir):
+    files = []
+    for filename in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, filename)
+        if os.path.isfile(path) and os.path.splitext(filename)[1].lower() in INPUT_EXTENSIONS:
+            files.append(path)
+    return files
+
+
+def worker_profile(name, profile_mode):
+    """
+    在工作进程中对单个任务进行性能分析。主进程的采样器看不到进程池中的其他进程。
+    """
+    return profile_run(name, profile_mode) if profile_mode else nullcontext()
+
+
+def ingest_and_clean_file(file_path, profile_mode=None):
+    """
+    读取单个文件,清洗并存入数据库。在进程池的工作进程中运行。
+
+    Returns:
+        dict: 该文件的处理结果和各阶段耗时。
+    """
+    label = os.path.basename(file_path)
+    result = {'file': file_path, 'orders': 0, 'batch_ids': [], 'timings': {}, 'error': None}
+    try:
+        with worker_profile(f"cli_clean_{os.path.splitext(label)[0]}", profile_mode):
+            started = time.perf_counter()
+            input_data = read_input_file(file_path)
+            result['timings']['ingest'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            progress = console_progress(label)
+            chunks = split_orders(input_data) if input_data.strip() else []
+            for i, chunk in enumerate(chunks):
+                orders_list = clean_data_with_api(chunk)
+                if orders_list:
+                    result['batch_ids'].append(save_to_database(orders_list))
+                    result['orders'] += len(orders_list)
+                progress((i + 1) / len(chunks) * 100, f"已处理 {result['orders']} 个订单")
+            progress.flush()
+            log_order_processing(len(chunks))
+            result['timings']['clean'] = time.perf_counter() - started
+    except Exception as e:
+        logging.error(f"处理文件 {file_path} 时发生错误：{str(e)}")
+        result['error'] = str(e)
+    finally:
+        db_session.remove()
+    return result
+
+
+def parse_batch(batch_id, profile_mode=None):
+    """
+    解析单个批次的订单。在进程池的工作进程中运行。
+
+    Returns:
+        dict: 批次ID、解析出的订单数据、耗时和错误信息。
+    """
+    started = time.perf_counter()
+    try:
+        with worker_profile(f"cli_parse_{batch_id}", profile_mode):
+            progress = console_progress(f"解析 {batch_id}")
+            parsed_data = parse_pending_orders(progress, batch_id)
+            progress.flush()
+        return {'batch_id': batch_id, 'parsed': parsed_data,
+                'seconds': time.perf_counter() - started, 'error': None}
+    except Exception as e:
+        return {'batch_id': batch_id, 'parsed': [],
+                'seconds': time.perf_counter() - started, 'error': str(e)}
+    finally:
+        db_session.remove()
+
+
+def release_connections():
+    """
+    在创建进程池之前关闭当前进程的数据库连接,避免子进程继承同一个连接。
+    """
+    db_session.remove()
+    engine.dispose()
+
+
+def run_pipeline(input_dir, targets=None, workers=None, skip_dedup=False,
+                 export_format='parquet', commute_format='xlsx', incremental=False, profile_mode=None):
+    """
+    对目录中的所有订单文件执行完整流程。
+
+    Args:
+        input_dir (str): 存放订单文件(.docx / .txt)的目录。
+        targets (list): 计算通勤时间的目标地址,为空时跳过该阶段。
+        workers (int): 进程池大小,默认为 CPU 核数。
+        skip_dedup (bool): 是否跳过去重阶段。
+        export_format (str): 解析结果的导出格式,默认 parquet,便于通勤时间阶段快速读取。
+        commute_format (str): 通勤时间结果的格式,默认 xlsx。
+        incremental (bool): 是否复用已缓存的通勤结果,只计算新的地址和目标组合。
+        profile_mode (str): 设置后进程池中的每个任务各自写出 wall 或 cpu 性能分析结果。
+
+    Returns:
+        dict: 可序列化为 JSON 的运行摘要。
+    """
+    summary = {
+        'input_dir': input_dir,
+        'started_at': datetime.now().isoformat(),
+        'stages': {},
+        'files': [],
+        'batches': [],
+    }
+    run_started = time.perf_counter()
+
+    files = find_input_files(input_dir)
+    logging.info(f"在 {input_dir} 中找到 {len(files)} 个订单文件")
+
+    # 读取和清洗:各文件相互独立,在进程池中并行处理
+    started = time.perf_counter()
+    release_connections()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        file_results = list(pool.map(partial(ingest_and_clean_file, profile_mode=profile_mode), files))
+    summary['files'] = file_results
+    summary['stages']['ingest_clean'] = {
+        'seconds': time.perf_counter() - started,
+        'ingest_seconds': sum(r['timings'].get('ingest', 0) for r in file_results),
+        'clean_seconds': sum(r['timings'].get('clean', 0) for r in file_results),
+        'orders': sum(r['orders'] for r in file_results),
+        'failed_files': sum(1 for r in file_results if r['error']),
+    }
+
+    # 去重:针对整个数据库,只执行一次
+    if not skip_dedup:
+        started = time.perf_counter()
+        progress = console_progress("去重")
+        removed_count = remove_duplicates(progress)
+        progress.flush()
+        summary['stages']['dedup'] = {'seconds': time.perf_counter() - started, 'removed': removed_count}
+
+    # 解析:按本次生成的批次并行
+    batch_ids = [batch_id for r in file_results for batch_id in r['batch_ids']]
+    started = time.perf_counter()
+    release_connections()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch_results = list(pool.map(partial(parse_batch, profile_mode=profile_mode), batch_ids))
+    parsed_data = [row for r in batch_results for row in r['parsed']]
+    summary['batches'] = [{'batch_id': r['batch_id'], 'parsed': len(r['parsed']),
+                           'seconds': r['seconds'], 'error': r['error']} for r in batch_results]
+    summary['stages']['parse'] = {
+        'seconds': time.perf_counter() - started,
+        'parsed': len(parsed_data),
+        'failed_batches': sum(1 for r in batch_results if r['error']),
+    }
+
+    # 导出
+    export_file = None
+    if parsed_data:
+        started = time.perf_counter()
+        export_file = export_to_excel(parsed_data, file_format=export_format)
+        summary['stages']['export'] = {'seconds': time.perf_counter() - started, 'file': export_file}
+
+    # 通勤时间
+    if targets and export_file:
+        started = time.perf_counter()
+        progress = console_progress("通勤时间")
+        commute_file = calculate_commute_times(os.path.join(os.getcwd(), 'exports', export_file), targets, progress,
+                                               commute_format, incremental)
+        progress.flush()
+        summary['stages']['commute'] = {'seconds': time.perf_counter() - started,
+                                        'file': os.path.basename(commute_file)}
+
+    summary['finished_at'] = datetime.now().isoformat()
+    summary['total_seconds'] = time.perf_counter() - run_started
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="命令行批量处理订单文件")
+    parser.add_argument('input_dir', help="存放订单文件(.docx / .txt)的目录")
+    parser.add_argument('--target', action='append', default=[],
+                        help="计算通勤时间的目标地址,可重复指定多个")
+    parser.add_argument('--workers', type=int, default=None, help="进程池大小,默认为 CPU 核数")
+    parser.add_argument('--skip-dedup', action='store_true', help="跳过去重阶段")
+    parser.add_argument('--export-format', choices=TABLE_FORMATS, default='parquet', help="解析结果的导出格式")
+    parser.add_argument('--commute-format', choices=TABLE_FORMATS, default='xlsx', help="通勤时间结果的格式")
+    parser.add_argument('--incremental', action='store_true', help="复用已缓存的通勤结果,只计算新的地址和目标组合")
+    parser.add_argument('--summary', help="把运行摘要写入该 JSON 文件,默认输出到标准输出")
+    parser.add_argument('--profile', choices=PROFILE_MODES,
+                        help="进行性能分析,主进程和进程池中的每个任务各写出一份结果")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"目录不存在: {args.input_dir}")
+
+    init_db()
+    ensure_batch_summaries()
+
+    with profile_run('cli', args.profile) if args.profile else nullcontext():
+        summary = run_pipeline(args.input_dir, args.target, args.workers, args.skip_dedup,
+                               args.export_format, args.commute_format, args.incremental, args.profile)
+
+    output = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    failed = summary['stages']['ingest_clean']['failed_files'] or summary['stages']['parse']['failed_batches']
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# commute_cache.py
+# 这个文件维护通勤时间缓存表 commute_results,使重复运行只需计算新出现的地址和目标组合
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from datetime import datetime, timedelta
+
+from database import db_session
+from models import CommuteResult
+
+COMMUTE_MODES = ('riding', 'transit')
+# 每次查询缓存时 IN 条件中的最多地址数
+LOOKUP_CHUNK_SIZE = 500
+
+
+def cache_max_age():
+    """
+    缓存有效期,由环境变量 COMMUTE_CACHE_MAX_AGE_DAYS 控制,默认 7 天。
+    """
+    return timedelta(days=float(os.getenv('COMMUTE_CACHE_MAX_AGE_DAYS', '7')))
+
+
+def normalize_address(address):
+    """
+    标准化地址文本:全角转半角、去掉空白、英文转小写。
+    """
+    if not isinstance(address, str):
+        return ''
+    address = unicodedata.normalize('NFKC', address)
+    return re.sub(r'\s+', '', address).lower()
+
+
+def address_key(address):
+    """
+    返回标准化地址的哈希值,地址为空时返回 None(不缓存)。
+    """
+    normalized = normalize_address(address)
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def load_fresh_results(addresses, targets):
+    """
+    读取未过期的通勤缓存。只有所有交通方式都有记录的组合才算命中。
+
+    Args:
+        addresses (list): 订单地址列表。
+        targets (list): 目标地址列表。
+
+    Returns:
+        dict: {(订单地址, 目标地址): {交通方式: 分钟数或 None}}。
+    """
+    address_keys = {}
+    for address in addresses:
+        key = address_key(address)
+        if key:
+            address_keys.setdefault(key, []).append(address)
+    target_keys = {address_key(target): target for target in targets if address_key(target)}
+    if not address_keys or not target_keys:
+        return {}
+
+    cutoff = datetime.now() - cache_max_age()
+    found = {}
+    keys = list(address_keys)
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        rows = db_session.query(
+            CommuteResult.address_key,
+            CommuteResult.target_key,
+            CommuteResult.mode,
+            CommuteResult.duration
+        ).filter(
+            CommuteResult.address_key.in_(keys[start:start + LOOKUP_CHUNK_SIZE]),
+            CommuteResult.target_key.in_(list(target_keys)),
+            CommuteResult.computed_at >= cutoff
+        ).all()
+        for row in rows:
+            found.setdefault((row.address_key, row.target_key), {})[row.mode] = row.duration
+
+    results = {}
+    for (a_key, t_key), durations in found.items():
+        if all(mode in durations for mode in COMMUTE_MODES):
+            for address in address_keys[a_key]:
+                results[(address, target_keys[t_key])] = durations
+    logging.info(f"通勤缓存命中 {len(results)} 个地址-目标组合")
+    return results
+
+
+def save_results(results):
+    """
+    保存新计算的通勤结果,覆盖同一组合的旧记录。
+
+    Args:
+        results (list): (订单地址, 目标地址, {交通方式: 分钟数或 None}) 列表。
+    """
+    # 不同写法的地址可能标准化为同一个键,同一个键只保留最后一次的结果
+    latest = {}
+    for address, target, durations in results:
+        # 有交通方式因接口出错没有结果时不缓存,下次重新计算
+        if not all(mode in durations for mode in COMMUTE_MODES):
+            continue
+        a_key, t_key = address_key(address), address_key(target)
+        if a_key and t_key:
+            latest[(a_key, t_key)] = (address, target, durations)
+
+    if not latest:
+        return
+    now = datetime.now()
+    try:
+        for (a_key, t_key), (address, target, durations) in latest.items():
+            db_session.query(CommuteResult).filter(
+                CommuteResult.address_key == a_key,
+                CommuteResult.target_key == t_key
+            ).delete(synchronize_session=False)
+            for mode in COMMUTE_MODES:
+                db_session.add(CommuteResult(
+                    address_key=a_key,
+                    target_key=t_key,
+                    mode=mode,
+                    address=address[:255],
+                    target=target[:255],
+                    duration=durations.get(mode),
+                    computed_at=now
+                ))
+        db_session.commit()
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"保存通勤缓存时出错：{str(e)}")
+        raise
@@ -1,6 +1,6 @@
 # database.py
 # 这个文件设置了数据库连接和会话管理
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, literal
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
@@ -21,7 +21,8 @@ def create_database_if_not_exists(url):
     conn.close()
 
 database_url = os.getenv('DATABASE_URL')
-create_database_if_not_exists(database_url)
+if not database_url.startswith('sqlite'):
+    create_database_if_not_exists(database_url)
 
 engine = create_engine(database_url)
 db_session = scoped_session(sessionmaker(autocommit=False,
@@ -41,6 +42,8 @@ def init_db():
     import models
     try:
         Base.metadata.create_all(bind=engine)
+        upgrade_schema()
+        ensure_fulltext_index()
         logging.info("数据库表创建成功")
         test_db_connection()
     except Exception as e:
@@ -49,3 +52,97 @@ def init_db():
 def table_exists(table_name):
     ins = inspect(engine)
     return ins.has_table(table_name)
+
+def upgrade_schema():
+    """
+    为已存在的表补上模型中新增的列和索引。
+    create_all 只会创建缺失的表,不会修改已有的表结构。
+    """
+    ins = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not ins.has_table(table.name):
+            continue
+        existing_columns = {column['name'] for column in ins.get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    # 带上模型中的默认值,已有的行会按默认值填充,而不是留空
+                    default_clause = ''
+                    if column.default is not None and column.default.is_scalar:
+                        default_value = literal(column.default.arg, column.type).compile(
+                            dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+                        default_clause = f" DEFAULT {default_value}"
+                    conn.execute(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default_clause}")
+                    logging.info(f"已为表 {table.name} 添加列 {column.name}")
+        existing_indexes = {index['name'] for index in ins.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=engine)
+                logging.info(f"已为表 {table.name} 创建索引 {index.name}")
+
+# 只在被索引的列变化时重建索引行,回填类型化字段、缓存坐标、写回解析结果等更新不触发
+FTS_UPDATE_TRIGGER = (
+    "CREATE TRIGGER orders_fts_update AFTER UPDATE OF original_text, requirements ON orders BEGIN "
+    "INSERT INTO orders_fts(orders_fts, rowid, original_text, requirements) "
+    "VALUES ('delete', old.id, old.original_text, old.requirements); "
+    "INSERT INTO orders_fts(rowid, original_text, requirements) "
+    "VALUES (new.id, new.original_text, new.requirements); END"
+)
+
+def ensure_fulltext_index():
+    """
+    为订单原文和要求建立全文索引。
+
+    MySQL 使用支持中文的 ngram 分词 FULLTEXT 索引,由数据库随写入自动维护;
+    SQLite 使用 FTS5 外部内容表,通过触发器在订单插入、删除以及原文或要求被修改时同步。
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == 'mysql':
+            exists = conn.execute(
+                "SHOW INDEX FROM orders WHERE Key_name = 'ft_orders_text'"
+            ).first()
+            if not exists:
+                conn.execute(
+                    "ALTER TABLE orders ADD FULLTEXT INDEX ft_orders_text "
+                    "(original_text, requirements) WITH PARSER ngram"
+                )
+                logging.info("已创建订单全文索引 ft_orders_text")
+        elif dialect == 'sqlite':
+            exists = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'orders_fts'"
+            ).first()
+            if exists:
+                ensure_fts_update_trigger(conn)
+                return
+            conn.execute(
+                "CREATE VIRTUAL TABLE orders_fts USING fts5("
+                "original_text, requirements, content='orders', content_rowid='id', tokenize='trigram')"
+            )
+            conn.execute(
+                "CREATE TRIGGER orders_fts_insert AFTER INSERT ON orders BEGIN "
+                "INSERT INTO orders_fts(rowid, original_text, requirements) "
+                "VALUES (new.id, new.original_text, new.requirements); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER orders_fts_delete AFTER DELETE ON orders BEGIN "
+                "INSERT INTO orders_fts(orders_fts, rowid, original_text, requirements) "
+                "VALUES ('delete', old.id, old.original_text, old.requirements); END"
+            )
+            conn.execute(FTS_UPDATE_TRIGGER)
+            conn.execute("INSERT INTO orders_fts(orders_fts) VALUES ('rebuild')")
+            logging.info("已创建订单全文索引表 orders_fts")
+
+def ensure_fts_update_trigger(conn):
+    """
+    把旧版本创建的、任何列更新都会触发的 orders_fts_update 替换为只监听被索引列的版本。
+    """
+    trigger_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'orders_fts_update'"
+    ).scalar()
+    if trigger_sql and 'UPDATE OF' in trigger_sql.upper():
+        return
+    conn.execute("DROP TRIGGER IF EXISTS orders_fts_update")
+    conn.execute(FTS_UPDATE_TRIGGER)
+    logging.info("已更新订单全文索引触发器 orders_fts_update")
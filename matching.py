@@ -0,0 +1,272 @@
+# matching.py
+# 这个文件实现了老师与订单的自动匹配,基于距离、科目、性别要求和价格构建代价矩阵并求解指派问题
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+from database import db_session
+from models import Order
+from normalize import gender_code, parse_hourly_price
+from utils import geocode_with_retry, read_table
+
+# 不可行的老师-订单组合使用的代价
+INFEASIBLE_COST = 1e9
+# 代价矩阵单元数不超过该值时使用匈牙利算法求最优解,超过时使用贪心近似
+EXACT_SOLVER_MAX_CELLS = 5_000_000
+# 贪心近似时每位老师只考虑代价最低的若干个订单
+GREEDY_CANDIDATES_PER_TUTOR = 50
+
+TUTOR_COLUMNS = ['姓名', '地址', '科目', '性别']
+
+
+def split_subjects(text):
+    """
+    将老师可教科目字符串(如 "数学,英语")拆分为科目列表。
+    """
+    if not isinstance(text, str):
+        return []
+    return [subject for subject in re.split(r'[,，、/;；\s]+', text) if subject]
+
+
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """
+    计算两组坐标之间的球面距离矩阵(公里),形状为 (len(lat1), len(lat2))。
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    lng1 = np.radians(np.asarray(lng1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    lng2 = np.radians(np.asarray(lng2, dtype=float))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def subject_match_matrix(tutor_subjects, order_subjects):
+    """
+    计算老师能否教授订单科目的布尔矩阵。
+
+    先为每个科目关键词算出它出现在哪些订单中,再通过矩阵乘法合并到每位老师,
+    避免逐对比较字符串。没有填写科目的老师或订单视为不限。
+    """
+    order_subjects = pd.Series(order_subjects, dtype=object).fillna('').astype(str)
+    tokens = sorted({subject for subjects in tutor_subjects for subject in subjects})
+    token_index = {token: i for i, token in enumerate(tokens)}
+
+    tutor_tokens = np.zeros((len(tutor_subjects), len(tokens)), dtype=np.int32)
+    for i, subjects in enumerate(tutor_subjects):
+        for subject in subjects:
+            tutor_tokens[i, token_index[subject]] = 1
+
+    token_orders = np.zeros((len(tokens), len(order_subjects)), dtype=np.int32)
+    for token, i in token_index.items():
+        token_orders[i] = order_subjects.str.contains(token, regex=False).to_numpy()
+
+    matches = (tutor_tokens @ token_orders) > 0
+    matches[tutor_tokens.sum(axis=1) == 0, :] = True
+    matches[:, (order_subjects == '').to_numpy()] = True
+    return matches
+
+
+def build_cost_matrix(tutors, orders, price_weight=0.05, max_distance_km=None):
+    """
+    构建老师×订单的代价矩阵。
+
+    代价为老师到订单地址的距离(公里)减去价格奖励,科目或性别要求不符、
+    超出最大距离以及任一方坐标未知的组合标记为不可行。
+
+    Args:
+        tutors (pd.DataFrame): 老师数据,包含 科目、性别、latitude、longitude 列。
+        orders (pd.DataFrame): 订单数据,包含 subject、gender_code、price_per_hour、latitude、longitude 列。
+        price_weight (float): 每元课时费抵扣的代价(公里)。
+        max_distance_km (float): 最大可接受距离,为 None 时不限制。
+
+    Returns:
+        tuple: (代价矩阵, 可行性矩阵, 距离矩阵)。
+    """
+    distance = haversine_matrix(tutors['latitude'], tutors['longitude'],
+                                orders['latitude'], orders['longitude'])
+
+    # 坐标未知时距离为 NaN,无法判断远近,不参与匹配
+    feasible = ~np.isnan(distance)
+    feasible &= subject_match_matrix([split_subjects(s) for s in tutors['科目']], orders['subject'])
+
+    tutor_genders = np.array([gender_code(g) for g in tutors['性别']])
+    order_genders = orders['gender_code'].to_numpy()
+    feasible &= (order_genders[None, :] == 0) | (order_genders[None, :] == tutor_genders[:, None])
+
+    if max_distance_km is not None:
+        feasible &= distance <= max_distance_km
+
+    prices = np.nan_to_num(orders['price_per_hour'].to_numpy(dtype=float), nan=0.0)
+
+    cost = distance - price_weight * prices[None, :]
+    cost = np.where(feasible, cost, INFEASIBLE_COST)
+    return cost, feasible, distance
+
+
+def solve_assignment(cost, feasible):
+    """
+    求解指派问题,每位老师(行)最多匹配一个订单(列)。
+
+    规模不超过 EXACT_SOLVER_MAX_CELLS 时使用匈牙利算法求最优解,
+    否则在每位老师代价最低的候选订单中按代价从低到高贪心分配。
+
+    Returns:
+        list: (行号, 列号) 列表,只包含可行的组合。
+    """
+    n_rows, n_cols = cost.shape
+    if n_rows == 0 or n_cols == 0:
+        return []
+
+    if n_rows * n_cols <= EXACT_SOLVER_MAX_CELLS:
+        rows, cols = linear_sum_assignment(cost)
+        return [(r, c) for r, c in zip(rows, cols) if feasible[r, c]]
+
+    k = min(GREEDY_CANDIDATES_PER_TUTOR, n_cols)
+    candidate_cols = np.argpartition(cost, k - 1, axis=1)[:, :k]
+    candidate_rows = np.repeat(np.arange(n_rows), k)
+    candidate_cols = candidate_cols.ravel()
+    candidate_cost = cost[candidate_rows, candidate_cols]
+    order = np.argsort(candidate_cost, kind='stable')
+
+    row_used = np.zeros(n_rows, dtype=bool)
+    col_used = np.zeros(n_cols, dtype=bool)
+    pairs = []
+    for idx in order:
+        r, c = candidate_rows[idx], candidate_cols[idx]
+        if row_used[r] or col_used[c] or not feasible[r, c]:
+            continue
+        row_used[r] = col_used[c] = True
+        pairs.append((r, c))
+    return pairs
+
+
+def geocode_missing(df, address_column, progress_callback=None):
+    """
+    为 DataFrame 中缺少坐标的行解析地址坐标,相同地址只解析一次。
+    """
+    missing = df['latitude'].isna() & df[address_column].fillna('').astype(str).str.strip().ne('')
+    addresses = df.loc[missing, address_column].astype(str).unique()
+    coords = {}
+    for i, address in enumerate(addresses):
+        coords[address], _ = geocode_with_retry(address)
+        if progress_callback:
+            progress_callback((i + 1) / len(addresses) * 100, f"已解析 {i + 1}/{len(addresses)} 个地址")
+    for index in df.index[missing]:
+        location = coords.get(str(df.at[index, address_column]))
+        if location:
+            df.at[index, 'latitude'], df.at[index, 'longitude'] = location
+    return df
+
+
+def load_orders_for_matching(batch_id=None, progress_callback=None):
+    """
+    读取已解析的订单,为缺少坐标的订单解析坐标并写回数据库。
+
+    Returns:
+        pd.DataFrame: 订单数据。
+    """
+    query = Order.query.filter(Order.address != '', Order.address != None)
+    if batch_id:
+        query = query.filter(Order.batch_id == batch_id)
+    orders = query.all()
+
+    df = pd.DataFrame([{
+        'id': order.id,
+        'address': order.address,
+        'subject': order.subject,
+        'tutoring_time': order.tutoring_time,
+        'price': order.price,
+        'teacher_gender': order.teacher_gender,
+        'original_text': order.original_text,
+        'latitude': order.latitude,
+        'longitude': order.longitude,
+        # 尚未补全类型化字段的旧订单直接从文本计算
+        'price_per_hour': order.price_per_hour if order.price_per_hour is not None
+                          else parse_hourly_price(order.price),
+        'gender_code': order.gender_code if order.gender_code is not None
+                       else gender_code(order.teacher_gender),
+    } for order in orders], columns=['id', 'address', 'subject', 'tutoring_time', 'price',
+                                     'teacher_gender', 'original_text', 'latitude', 'longitude',
+                                     'price_per_hour', 'gender_code'])
+    df[['latitude', 'longitude', 'price_per_hour']] = df[['latitude', 'longitude', 'price_per_hour']].astype(float)
+    df['gender_code'] = df['gender_code'].fillna(0).astype(int)
+
+    missing_before = df['latitude'].isna()
+    geocode_missing(df, 'address', progress_callback)
+    resolved = missing_before & df['latitude'].notna()
+    if resolved.any():
+        try:
+            orders_by_id = {order.id: order for order in orders}
+            for row in df[resolved].itertuples():
+                order = orders_by_id[row.id]
+                order.latitude = row.latitude
+                order.longitude = row.longitude
+            db_session.commit()
+            logging.info(f"已为 {int(resolved.sum())} 个订单保存坐标")
+        except Exception as e:
+            db_session.rollback()
+            logging.error(f"保存订单坐标时出错：{str(e)}")
+            raise
+    return df
+
+
+def read_tutors(file_path):
+    """
+    读取老师信息表格(xlsx / parquet / csv),需要包含 姓名、地址、科目、性别 列,
+    可选 最多接单数 列(默认为 1)。
+    """
+    tutors = read_table(file_path)
+    missing_columns = [col for col in TUTOR_COLUMNS if col not in tutors.columns]
+    if missing_columns:
+        raise ValueError(f"老师信息文件缺少以下必要的列: {', '.join(missing_columns)}")
+    if '最多接单数' not in tutors.columns:
+        tutors['最多接单数'] = 1
+    tutors['最多接单数'] = pd.to_numeric(tutors['最多接单数'], errors='coerce').fillna(1).clip(lower=0).astype(int)
+    tutors['latitude'] = np.nan
+    tutors['longitude'] = np.nan
+    return tutors.reset_index(drop=True)
+
+
+def match_tutors(tutors, orders, price_weight=0.05, max_distance_km=None):
+    """
+    为老师分配订单。
+
+    可接多个订单的老师在代价矩阵中按 最多接单数 复制为多行。
+
+    Returns:
+        list: 匹配结果,每个元素是一条用于导出的字典。
+    """
+    unlocated_tutors = int(tutors['latitude'].isna().sum())
+    unlocated_orders = int(orders['latitude'].isna().sum())
+    if unlocated_tutors or unlocated_orders:
+        logging.warning(f"{unlocated_tutors} 位老师、{unlocated_orders} 个订单的地址无法解析坐标，不参与匹配")
+
+    slots = np.repeat(np.arange(len(tutors)), tutors['最多接单数'].to_numpy())
+    slot_tutors = tutors.iloc[slots].reset_index(drop=True)
+
+    cost, feasible, distance = build_cost_matrix(slot_tutors, orders, price_weight, max_distance_km)
+    pairs = solve_assignment(cost, feasible)
+    logging.info(f"老师接单名额 {len(slot_tutors)} 个，订单 {len(orders)} 个，成功匹配 {len(pairs)} 对")
+
+    results = []
+    for r, c in pairs:
+        tutor = slot_tutors.iloc[r]
+        order = orders.iloc[c]
+        results.append({
+            '老师姓名': tutor['姓名'],
+            '老师地址': tutor['地址'],
+            '老师科目': tutor['科目'],
+            '订单ID': int(order['id']),
+            '订单地址': order['address'],
+            '科目': order['subject'],
+            '上课时间': order['tutoring_time'],
+            '价格': order['price'],
+            '老师性别': order['teacher_gender'],
+            '距离(公里)': round(float(distance[r, c]), 2),
+            '原始订单': order['original_text'],
+        })
+    results.sort(key=lambda row: (str(row['老师姓名']), row['距离(公里)']))
+    return results
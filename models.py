@@ -1,6 +1,6 @@
 # models.py
 # 这个文件定义了数据库模型,使用SQLAlchemy ORM
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Index, Boolean, UniqueConstraint
 from database import Base
 
 class Order(Base):
@@ -16,6 +16,52 @@ class Order(Base):
     teacher_gender = Column(String(20))
     student_info = Column(Text)
     order_number = Column(String(50))
+    # 订单地址的坐标,在匹配老师时按需解析并缓存
+    latitude = Column(Float)
+    longitude = Column(Float)
+    # 由文本字段推导出的类型化字段,解析订单时填充,见 normalize.py
+    price_per_hour = Column(Float)
+    subject_code = Column(String(20))
+    gender_code = Column(Integer)
+    time_slots = Column(Integer)
+    # 最近一次解析是否失败,用于维护批次汇总中的失败数
+    parse_failed = Column(Boolean, default=False)
+    # 原始订单文本的 SHA-256,用于入库时去重
+    text_hash = Column(String(64), index=True)
     # 暂时注释掉 created_at 字段
     # created_at = Column(DateTime)
     # ... 其他字段 ...
+
+    __table_args__ = (
+        Index('ix_orders_subject_price', 'subject_code', 'price_per_hour'),
+        Index('ix_orders_gender_subject', 'gender_code', 'subject_code'),
+        Index('ix_orders_batch_subject', 'batch_id', 'subject_code'),
+    )
+
+class Batch(Base):
+    # 批次汇总表,随订单的保存、解析和去重增量维护,避免每次对 orders 表做 GROUP BY
+    __tablename__ = 'batches'
+    id = Column(String(50), primary_key=True)
+    total_count = Column(Integer, nullable=False, default=0)
+    parsed_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    duplicate_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+class CommuteResult(Base):
+    # 通勤时间缓存,按 (标准化订单地址, 目标地址, 交通方式) 保存,重复计算时只补算缺失或过期的组合
+    __tablename__ = 'commute_results'
+    id = Column(Integer, primary_key=True)
+    address_key = Column(String(64), nullable=False)
+    target_key = Column(String(64), nullable=False)
+    mode = Column(String(20), nullable=False)
+    address = Column(String(255))
+    target = Column(String(255))
+    # 通勤分钟数,为空表示该方式不可用(如距离超过骑行范围或没有公交路线)
+    duration = Column(Float)
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('address_key', 'target_key', 'mode', name='uq_commute_results_key'),
+    )
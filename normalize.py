@@ -0,0 +1,264 @@
+# normalize.py
+# 这个文件把订单解析出的自由文本字段转换为可在SQL中过滤和排序的类型化字段
+import logging
+import math
+import re
+
+from database import db_session, init_db
+from models import Order
+
+# 科目编码及其对应的科目名称关键词,按顺序匹配,取第一个命中的科目
+SUBJECT_KEYWORDS = {
+    'chinese': ['语文'],
+    'math': ['数学', '奥数'],
+    'english': ['英语', '雅思', '托福', 'KET', 'PET'],
+    'physics': ['物理'],
+    'chemistry': ['化学'],
+    'biology': ['生物'],
+    'history': ['历史'],
+    'geography': ['地理'],
+    'politics': ['政治', '道法', '道德与法治'],
+    'science': ['科学'],
+    'programming': ['编程', '信息', '计算机', 'Python', 'C++'],
+    'music': ['音乐', '钢琴', '小提琴', '吉他'],
+    'art': ['美术', '绘画', '书法'],
+}
+# 作文、阅读等通用技能词可与任何科目搭配(如 "英语阅读"),只在没有命中科目名称时使用
+SKILL_KEYWORDS = {
+    'chinese': ['作文', '阅读'],
+}
+SUBJECT_OTHER = 'other'
+
+# 性别编码
+GENDER_ANY = 0
+GENDER_MALE = 1
+GENDER_FEMALE = 2
+
+# 每周时间段位图: 第 day * 3 + period 位表示周几(0=周一)的某个时段(0=上午,1=下午,2=晚上)
+PERIODS = {'上午': 0, '早上': 0, '中午': 1, '下午': 1, '晚上': 2, '晚间': 2}
+DAY_NAMES = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6, '天': 6, '末': None}
+ALL_PERIODS = 0b111
+# "每周三次"、"每周一两次"、"每周一节课" 中紧跟在 周 后面的数字是频次,不是星期
+FREQUENCY_SUFFIX = re.compile(r'\s*(?:[一二两三四五六七八九十几]*次|节|课|小时)')
+
+PRICE_NUMBER = r'(\d+(?:\.\d+)?)'
+# 价格文本中明确按小时计价的写法,如 "150元/小时"、"每小时150"
+PER_HOUR_MARKER = re.compile(r'/\s*(?:小时|h|时)|每小时|时薪', re.IGNORECASE)
+# 价格文本中单独给出的课时长度,如 "2小时"、"1.5h"、"两小时"
+LESSON_HOURS = re.compile(r'(\d+(?:\.\d+)?|两)\s*个?\s*(?:小时|h)', re.IGNORECASE)
+
+
+def parse_hourly_price(text):
+    """
+    从价格文本中提取每小时价格。
+
+    支持 "150元/小时"、"300元/2小时"、"150-200元" (取平均值) 等写法。
+    优先取紧挨着 元 的数字作为金额;没有写明按小时计价而另外给出了 "N小时" 时,
+    金额按每次课计,除以 N。无法提取时返回 None。
+
+    >>> parse_hourly_price('150元/小时'), parse_hourly_price('300元/2小时'), parse_hourly_price('150-200元')
+    (150.0, 150.0, 175.0)
+    >>> parse_hourly_price('2小时300元'), parse_hourly_price('每次2小时，300元'), parse_hourly_price('300元/次(2小时)')
+    (150.0, 150.0, 150.0)
+    >>> parse_hourly_price('100元/小时，每次2小时'), parse_hourly_price('每小时120'), parse_hourly_price('200')
+    (100.0, 120.0, 200.0)
+    >>> parse_hourly_price('面议')
+    """
+    if not isinstance(text, str):
+        return None
+    per_hours = re.search(PRICE_NUMBER + r'\s*元?\s*/\s*' + PRICE_NUMBER + r'\s*(?:小时|h)', text, re.IGNORECASE)
+    if per_hours:
+        hours = float(per_hours.group(2))
+        return float(per_hours.group(1)) / hours if hours else None
+
+    amount_match = (
+        re.search(PRICE_NUMBER + r'\s*(?:[-~～至到]\s*' + PRICE_NUMBER + r'\s*)?元', text)
+        or re.search(PRICE_NUMBER + r'\s*[-~～至到]\s*' + PRICE_NUMBER, text)
+        # 跳过课时、次数等带单位的数字
+        or re.search(PRICE_NUMBER + r'(?![\d.])(?!\s*个?\s*(?:小时|h|分钟|次|节|课))', text, re.IGNORECASE)
+    )
+    if not amount_match:
+        return None
+    low, high = amount_match.group(1), amount_match.group(2) if amount_match.lastindex > 1 else None
+    amount = (float(low) + float(high)) / 2 if high else float(low)
+
+    if PER_HOUR_MARKER.search(text):
+        return amount
+    lesson_hours = LESSON_HOURS.search(text)
+    if lesson_hours:
+        hours = 2.0 if lesson_hours.group(1) == '两' else float(lesson_hours.group(1))
+        if hours:
+            return amount / hours
+    return amount
+
+
+def subject_code(text):
+    """
+    将科目文本转换为科目编码,无法识别时返回 other,为空时返回 None。
+
+    先匹配科目名称,再匹配作文、阅读等通用技能词:
+
+    >>> subject_code('英语阅读'), subject_code('英语作文'), subject_code('初中数学')
+    ('english', 'english', 'math')
+    >>> subject_code('阅读'), subject_code('小学作文'), subject_code('语文阅读')
+    ('chinese', 'chinese', 'chinese')
+    >>> subject_code('围棋'), subject_code('')
+    ('other', None)
+    """
+    if not isinstance(text, str) or not text.strip():
+        return None
+    lowered = text.lower()
+    for keyword_map in (SUBJECT_KEYWORDS, SKILL_KEYWORDS):
+        for code, keywords in keyword_map.items():
+            if any(keyword.lower() in lowered for keyword in keywords):
+                return code
+    return SUBJECT_OTHER
+
+
+def gender_code(text):
+    """
+    将性别文本转换为编码: 1 表示男, 2 表示女, 0 表示不限或未知。
+    """
+    if not isinstance(text, str):
+        return GENDER_ANY
+    has_male = '男' in text
+    has_female = '女' in text
+    if has_male and not has_female:
+        return GENDER_MALE
+    if has_female and not has_male:
+        return GENDER_FEMALE
+    return GENDER_ANY
+
+
+def parse_days(text):
+    """
+    解析文本中提到的星期,返回星期序号集合(0=周一)。
+
+    >>> sorted(parse_days('周一至周五晚上')), sorted(parse_days('周六日下午')), sorted(parse_days('周一三五'))
+    ([0, 1, 2, 3, 4], [5, 6], [0, 2, 4])
+    >>> sorted(parse_days('每周三次，时间灵活')), sorted(parse_days('每周一次')), sorted(parse_days('每周一两次'))
+    ([], [], [])
+    >>> sorted(parse_days('每周三两小时')), sorted(parse_days('周末两次'))
+    ([2], [5, 6])
+    """
+    days = set()
+    if re.search(r'每天|天天|每日', text):
+        return set(range(7))
+    if '工作日' in text:
+        days.update(range(5))
+    for start, end in re.findall(r'(?:周|星期|礼拜)([一二三四五六日天])\s*[-~～至到]\s*(?:周|星期|礼拜)?([一二三四五六日天])', text):
+        first, last = DAY_NAMES[start], DAY_NAMES[end]
+        days.update(range(first, last + 1) if first <= last else [])
+    # 连写的多个星期(如 "周六日"、"周一三五")逐字解析
+    for match in re.finditer(r'(?:周|星期|礼拜)([一二三四五六日天末]+)', text):
+        names = match.group(1)
+        if not re.search(r'[日天末]', names) and FREQUENCY_SUFFIX.match(text, match.end()):
+            continue
+        for name in names:
+            day = DAY_NAMES[name]
+            days.update([5, 6] if day is None else [day])
+    return days
+
+
+def parse_periods(text):
+    """
+    解析文本中提到的时段,返回时段位掩码;只写了钟点时按钟点推断时段。
+    """
+    mask = 0
+    for word, period in PERIODS.items():
+        if word in text:
+            mask |= 1 << period
+    if mask:
+        return mask
+    for hour in re.findall(r'(\d{1,2})\s*(?:[:：]\d{2}|点)', text):
+        hour = int(hour)
+        if hour < 12:
+            mask |= 1 << 0
+        elif hour < 18:
+            mask |= 1 << 1
+        else:
+            mask |= 1 << 2
+    return mask
+
+
+def time_slot_bitmap(text):
+    """
+    将上课时间文本转换为每周时间段位图,无法识别时返回 None。
+    """
+    if not isinstance(text, str) or not text.strip():
+        return None
+    days = parse_days(text)
+    periods = parse_periods(text)
+    if not days and not periods:
+        return None
+    if not days:
+        days = set(range(7))
+    if not periods:
+        periods = ALL_PERIODS
+    bitmap = 0
+    for day in days:
+        bitmap |= periods << (day * 3)
+    return bitmap
+
+
+def time_slot_mask(days=None, periods=None):
+    """
+    根据星期序号列表和时段序号列表构建用于查询的时间段掩码。
+    """
+    days = range(7) if not days else days
+    period_mask = ALL_PERIODS if not periods else sum(1 << period for period in set(periods))
+    mask = 0
+    for day in days:
+        mask |= period_mask << (day * 3)
+    return mask
+
+
+def apply_typed_fields(order):
+    """
+    根据订单的文本字段计算并设置类型化字段。
+    """
+    price = parse_hourly_price(order.price)
+    order.price_per_hour = price if price is not None and math.isfinite(price) else None
+    order.subject_code = subject_code(order.subject)
+    order.gender_code = gender_code(order.teacher_gender)
+    order.time_slots = time_slot_bitmap(order.tutoring_time)
+
+
+def backfill_typed_fields(batch_size=1000, progress_callback=None):
+    """
+    为已解析的订单补全类型化字段,按主键分段处理,每段提交一次。
+
+    Returns:
+        int: 更新的订单数量。
+    """
+    base_query = Order.query.filter(Order.address != '', Order.address != None)
+    total = base_query.count()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            orders = base_query.filter(Order.id > last_id) \
+                               .order_by(Order.id) \
+                               .limit(batch_size) \
+                               .all()
+            if not orders:
+                break
+            for order in orders:
+                apply_typed_fields(order)
+            db_session.commit()
+            updated += len(orders)
+            last_id = orders[-1].id
+            if progress_callback:
+                progress_callback(updated / total * 100, f"已更新 {updated}/{total} 个订单")
+        logging.info(f"成功补全 {updated} 个订单的类型化字段")
+        return updated
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"补全类型化字段时发生错误：{str(e)}")
+        raise
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    backfill_typed_fields()
@@ -0,0 +1,376 @@
+# pipeline.py
+# 这个文件实现流水线模式:清洗出的订单经入库去重后立即进入解析队列,各阶段之间用有界队列衔接,
+# 整体耗时接近最慢的一个阶段,而不是清洗、去重、解析三步耗时之和
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import db_session
+from models import Order
+from batches import record_batch_created, apply_batch_deltas, new_deltas, record_parse_result
+from utils import (
+    split_orders,
+    clean_data_with_api,
+    parse_order_with_api,
+    apply_parsed_fields,
+    export_to_excel,
+    generate_batch_id,
+    order_text_hash,
+    backfill_text_hashes,
+    log_order_processing
+)
+
+# 队列结束标记
+DONE = object()
+# 取消后阻塞在队列上的线程最多等待这么久(秒)就能发现取消标记
+QUEUE_POLL_SECONDS = 0.1
+# 解析结果每累计这么多条提交一次
+COMMIT_EVERY = 20
+# 写回解析结果时更新的订单字段
+WRITE_BACK_FIELDS = ('address', 'subject', 'tutoring_time', 'requirements', 'price', 'teacher_gender',
+                     'student_info', 'price_per_hour', 'subject_code', 'gender_code', 'time_slots',
+                     'parse_failed')
+
+
+class StreamingPipeline:
+    """
+    清洗 → 入库去重 → 解析 → 导出 的流水线。
+
+    - 清洗: clean_workers 个线程并行调用清洗 API,结果放入 cleaned 队列;
+    - 入库去重: 单个线程按文本哈希跳过库中和本次运行中已出现的订单,新订单入库后放入 parse 队列;
+    - 解析: parse_workers 个线程并行调用解析 API,结果放入 results 队列;
+    - 写回: 调用 run() 的线程按订单ID把解析结果写回数据库,并收集导出数据。
+      订单的原文和批次随队列传递,写回时不重新读取订单,不受其他线程提交时机的影响。
+
+    队列都是有界的,下游变慢时上游会阻塞等待,内存占用不会随输入增长。
+    写回阶段出错时设置取消标记,各线程不再调用 API,阻塞在队列上的线程也会退出,run() 不会卡住。
+
+    Args:
+        progress_callback (callable): 进度回调。
+        clean_workers (int): 清洗线程数。
+        parse_workers (int): 解析线程数。
+        queue_size (int): 每个队列的容量。
+        file_format (str): 导出格式,xlsx、parquet 或 csv。
+    """
+
+    def __init__(self, progress_callback, clean_workers=4, parse_workers=8, queue_size=32, file_format='xlsx'):
+        self.progress_callback = progress_callback
+        self.file_format = file_format
+        self.clean_workers = clean_workers
+        self.parse_workers = parse_workers
+        self.cleaned = queue.Queue(maxsize=queue_size)
+        self.to_parse = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.errors = []
+        self.stats = {'chunks': 0, 'cleaned_chunks': 0, 'cleaned': 0, 'saved': 0,
+                      'duplicates': 0, 'parsed': 0, 'failed': 0, 'write_failed': 0, 'batches': 0}
+
+    def put(self, q, item):
+        """
+        放入队列,队列满时等待;已取消时放弃并返回 False。
+        """
+        while not self.cancelled.is_set():
+            try:
+                q.put(item, timeout=QUEUE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, q):
+        """
+        从队列取出一项,队列空时等待;已取消时返回 DONE。
+        """
+        while not self.cancelled.is_set():
+            try:
+                return q.get(timeout=QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return DONE
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        clean_ratio = stats['cleaned_chunks'] / stats['chunks'] if stats['chunks'] else 1
+        written = stats['parsed'] + stats['failed'] + stats['write_failed']
+        parse_ratio = written / stats['saved'] if stats['saved'] else 0
+        progress = min(clean_ratio * parse_ratio * 95, 95)
+        # 进度推送失败不应影响订单处理
+        try:
+            self.progress_callback(progress, f"已清洗 {stats['cleaned_chunks']}/{stats['chunks']} 批，"
+                                             f"入库 {stats['saved']} 个订单，"
+                                             f"已解析 {written}/{stats['saved']} 个")
+        except Exception as e:
+            logging.warning(f"推送流水线进度失败：{str(e)}")
+
+    def record_error(self, stage, e):
+        logging.error(f"流水线{stage}阶段发生错误：{str(e)}")
+        with self.lock:
+            self.errors.append(f"{stage}: {str(e)}")
+
+    def clean_chunk(self, chunk):
+        if self.cancelled.is_set():
+            return
+        try:
+            orders_list = clean_data_with_api(chunk)
+            if orders_list:
+                self.put(self.cleaned, orders_list)
+        except Exception as e:
+            self.record_error("清洗", e)
+        finally:
+            with self.lock:
+                self.stats['cleaned_chunks'] += 1
+            self.report()
+
+    def feed(self, chunks):
+        try:
+            with ThreadPoolExecutor(max_workers=self.clean_workers) as executor:
+                list(executor.map(self.clean_chunk, chunks))
+        finally:
+            self.put(self.cleaned, DONE)
+
+    def save_cleaned(self, orders_list, seen):
+        """
+        按文本哈希过滤重复订单,把新订单作为一个批次入库。
+        跳过的重复订单计入该批次的 duplicate_count,全部重复时也登记一个订单数为 0 的批次。
+
+        Returns:
+            list: 新入库订单的 (订单ID, 批次ID, 原始文本)。
+        """
+        candidates = {}
+        duplicates = 0
+        for order_text in orders_list:
+            if not isinstance(order_text, str):
+                raise TypeError("每个订单必须是字符串类型")
+            text_hash = order_text_hash(order_text)
+            if text_hash in seen or text_hash in candidates:
+                duplicates += 1
+            else:
+                candidates[text_hash] = order_text
+
+        if candidates:
+            existing = {row.text_hash for row in
+                        db_session.query(Order.text_hash).filter(Order.text_hash.in_(list(candidates)))}
+            duplicates += len(existing)
+            for text_hash in existing:
+                del candidates[text_hash]
+
+        batch_id = generate_batch_id()
+        try:
+            orders = [Order(
+                batch_id=batch_id,
+                original_text=order_text,
+                address='',
+                subject='',
+                tutoring_time='',
+                requirements='',
+                price='',
+                teacher_gender='',
+                student_info='',
+                order_number='',
+                parse_failed=False,
+                text_hash=text_hash
+            ) for text_hash, order_text in candidates.items()]
+            if orders:
+                db_session.add_all(orders)
+            record_batch_created(batch_id, len(orders))
+            deltas = new_deltas()
+            deltas[batch_id]['duplicate'] += duplicates
+            db_session.flush()
+            saved = [(order.id, batch_id, order.original_text) for order in orders]
+            apply_batch_deltas(deltas)
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        seen.update(candidates)
+        logging.info(f"流水线保存 {len(orders)} 个订单，跳过 {duplicates} 个重复订单，批次ID：{batch_id}")
+        with self.lock:
+            self.stats['saved'] += len(orders)
+            self.stats['duplicates'] += duplicates
+            self.stats['batches'] += 1
+        return saved
+
+    def save(self):
+        seen = set()
+        try:
+            while True:
+                orders_list = self.get(self.cleaned)
+                if orders_list is DONE:
+                    break
+                with self.lock:
+                    self.stats['cleaned'] += len(orders_list)
+                try:
+                    for item in self.save_cleaned(orders_list, seen):
+                        self.put(self.to_parse, item)
+                except Exception as e:
+                    self.record_error("入库", e)
+        finally:
+            db_session.remove()
+            for _ in range(self.parse_workers):
+                self.put(self.to_parse, DONE)
+
+    def parse(self):
+        try:
+            while True:
+                item = self.get(self.to_parse)
+                if item is DONE:
+                    break
+                order_id, batch_id, order_text = item
+                try:
+                    parsed = parse_order_with_api(order_text)
+                except Exception as e:
+                    self.record_error("解析", e)
+                    parsed = {}
+                self.put(self.results, (order_id, batch_id, order_text, parsed))
+        finally:
+            self.put(self.results, DONE)
+
+    @staticmethod
+    def new_pending():
+        return {'rows': [], 'deltas': new_deltas(), 'parsed': 0, 'failed': 0}
+
+    def write_result(self, item, pending):
+        """
+        在当前事务中按订单ID写回一条解析结果,结果计入 pending,提交后才计入统计。
+        """
+        order_id, batch_id, order_text, parsed = item
+        # 新入库的订单尚未解析过,用不加入会话的临时对象计算要写回的字段
+        order = Order(id=order_id, batch_id=batch_id, original_text=order_text, address='', parse_failed=False)
+        if parsed:
+            apply_parsed_fields(order, parsed)
+        item_deltas = new_deltas()
+        success = record_parse_result(item_deltas, order)
+
+        updated = db_session.query(Order).filter(Order.id == order_id).update(
+            {field: getattr(order, field) for field in WRITE_BACK_FIELDS}, synchronize_session=False)
+        if not updated:
+            # 订单可能已被并发的去重操作删除
+            self.record_error("写回", f"订单 {order_id} 不存在，解析结果未写回")
+            with self.lock:
+                self.stats['write_failed'] += 1
+            return
+
+        for changed_batch, changes in item_deltas.items():
+            for name, delta in changes.items():
+                pending['deltas'][changed_batch][name] += delta
+        if success:
+            pending['parsed'] += 1
+            pending['rows'].append({
+                '订单ID': order_id,
+                '地址': order.address,
+                '科目': order.subject,
+                '上课时间': order.tutoring_time,
+                '要求': order.requirements,
+                '价格': order.price,
+                '老师性别': order.teacher_gender,
+                '学生情况': order.student_info,
+                '原始订单': order_text
+            })
+        else:
+            pending['failed'] += 1
+            logging.warning(f"订单 {order_id} 解析失败")
+
+    def commit_pending(self, pending, parsed_data):
+        """
+        提交 pending 中的结果,成功后才计入统计和导出数据。
+        """
+        try:
+            apply_batch_deltas(pending['deltas'])
+            db_session.commit()
+        except Exception as e:
+            self.discard_pending(pending['parsed'] + pending['failed'], e)
+            return
+        parsed_data.extend(pending['rows'])
+        with self.lock:
+            self.stats['parsed'] += pending['parsed']
+            self.stats['failed'] += pending['failed']
+
+    def discard_pending(self, lost, e):
+        """
+        回滚后丢弃未提交的结果,这些订单仍是未解析状态,计入写回失败数。
+        """
+        db_session.rollback()
+        self.record_error("写回", e)
+        logging.error(f"{lost} 个订单的解析结果未能写回")
+        with self.lock:
+            self.stats['write_failed'] += lost
+
+    def write_results(self):
+        """
+        把解析结果写回数据库,每 COMMIT_EVERY 条提交一次。
+
+        Returns:
+            list: 解析成功的订单数据。
+        """
+        # 结束之前的读取开启的事务: MySQL 可重复读隔离级别下,事务的第一次读取就固定了快照
+        db_session.commit()
+        parsed_data = []
+        pending = self.new_pending()
+        finished_workers = 0
+        while finished_workers < self.parse_workers:
+            item = self.get(self.results)
+            if item is DONE:
+                finished_workers += 1
+                continue
+            # 写回失败时只记录错误并继续消费队列,避免解析线程因队列满而阻塞
+            try:
+                self.write_result(item, pending)
+                self.report()
+            except Exception as e:
+                # 回滚会同时丢弃本批次中之前已写入的结果,当前这条也计入
+                self.discard_pending(pending['parsed'] + pending['failed'] + 1, e)
+                pending = self.new_pending()
+            if pending['parsed'] + pending['failed'] >= COMMIT_EVERY:
+                self.commit_pending(pending, parsed_data)
+                pending = self.new_pending()
+        if pending['parsed'] + pending['failed']:
+            self.commit_pending(pending, parsed_data)
+        return parsed_data
+
+    def run(self, input_data):
+        """
+        运行流水线,返回 (统计信息, 导出文件名)。没有解析成功的订单时文件名为 None。
+        """
+        backfill_text_hashes()
+        chunks = split_orders(input_data)
+        self.stats['chunks'] = len(chunks)
+
+        threads = [threading.Thread(target=self.feed, args=(chunks,), name='pipeline-clean'),
+                   threading.Thread(target=self.save, name='pipeline-save')]
+        threads += [threading.Thread(target=self.parse, name=f'pipeline-parse-{i}')
+                    for i in range(self.parse_workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            parsed_data = self.write_results()
+        except Exception:
+            # 通知其他线程停止,否则它们会一直阻塞在没人消费的队列上,join 永远不会返回
+            self.cancelled.set()
+            db_session.rollback()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        log_order_processing(len(chunks))
+        file_path = None
+        if parsed_data:
+            self.progress_callback(97, "正在导出到Excel...")
+            file_path = export_to_excel(parsed_data, file_format=self.file_format)
+        self.progress_callback(100, "处理完成")
+        stats = dict(self.stats, errors=list(self.errors))
+        logging.info(f"流水线处理完成：{stats}")
+        return stats, file_path
+
+
+def process_and_export_orders(input_data, progress_callback, clean_workers=4, parse_workers=8, file_format='xlsx'):
+    """
+    以流水线方式把原始订单文本处理为导出的 Excel 文件。
+    """
+    pipeline = StreamingPipeline(progress_callback, clean_workers, parse_workers, file_format=file_format)
+    return pipeline.run(input_data)
@@ -0,0 +1,207 @@
+# profiling.py
+# 这个文件提供按需开启的采样分析器,把请求或任务的调用栈采样写成火焰图(speedscope / folded)文件
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILES_DIR = os.path.join(os.getcwd(), 'profiles')
+PROFILE_MODES = ('wall', 'cpu')
+DEFAULT_INTERVAL = 0.005
+
+
+def profiling_enabled():
+    """
+    是否允许开启性能分析,由环境变量 PROFILING_ENABLED 控制。
+    """
+    return os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+
+class StackSampler:
+    """
+    在后台线程中定期采样目标线程以及采样期间新启动的线程的调用栈。
+
+    请求的实际工作常在流水线、线程池等新线程中完成,只采样目标线程只能看到它在队列上等待;
+    采样开始前就已存在的其他线程(如其他请求)不采样。每个线程单独统计,导出为各自的 profile。
+
+    wall 模式下每个样本的权重是采样间隔内经过的真实时间,包括等待网络和数据库的时间;
+    cpu 模式下权重是该线程在该间隔内消耗的 CPU 时间,等待期间的样本权重为 0。
+
+    Args:
+        thread_id (int): 目标线程的 ident。
+        mode (str): wall 或 cpu。
+        interval (float): 采样间隔(秒)。
+    """
+
+    def __init__(self, thread_id, mode='wall', interval=DEFAULT_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的分析模式: {mode}")
+        self.thread_id = thread_id
+        self.mode = mode
+        self.interval = interval
+        # {线程 ident: Counter({调用栈: 权重})}
+        self.stacks = {}
+        self.thread_names = {}
+        self.frames = {}
+        self._ignored = set()
+        self._clocks = {}
+        self._last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        # 按线程对象记录,线程结束后 ident 被新线程复用时新线程仍会被采样
+        self._ignored = {thread for thread in threading.enumerate() if thread.ident != self.thread_id}
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _elapsed(self, thread_id, now):
+        """
+        返回该线程自上次采样以来的权重;首次见到的线程只记录起点。
+        """
+        if self.mode == 'cpu':
+            try:
+                if thread_id not in self._clocks:
+                    self._clocks[thread_id] = time.pthread_getcpuclockid(thread_id)
+                now = time.clock_gettime(self._clocks[thread_id])
+            except OSError:
+                # 线程已经结束
+                return 0
+        last = self._last.get(thread_id)
+        self._last[thread_id] = now
+        return now - last if last is not None else 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                thread = threads.get(thread_id)
+                if thread in self._ignored or thread is self._thread:
+                    continue
+                weight = self._elapsed(thread_id, now)
+                if weight <= 0:
+                    continue
+                self.thread_names.setdefault(thread_id, thread.name if thread else str(thread_id))
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code.co_name, code.co_filename, code.co_firstlineno)
+                    if key not in self.frames:
+                        self.frames[key] = len(self.frames)
+                    stack.append(self.frames[key])
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks.setdefault(thread_id, Counter())[tuple(stack)] += weight
+
+    def _thread_order(self):
+        # 目标线程排在最前,speedscope 默认显示第一个 profile
+        return sorted(self.stacks, key=lambda thread_id: (thread_id != self.thread_id,
+                                                          self.thread_names.get(thread_id, '')))
+
+    def to_speedscope(self, name):
+        frames = [None] * len(self.frames)
+        for (func_name, file, line), index in self.frames.items():
+            frames[index] = {'name': func_name, 'file': file, 'line': line}
+        profiles = []
+        for thread_id in self._thread_order():
+            stacks = self.stacks[thread_id]
+            samples = list(stacks.keys())
+            weights = [stacks[stack] for stack in samples]
+            profiles.append({
+                'type': 'sampled',
+                'name': f"{name} [{self.thread_names[thread_id]}] ({self.mode})",
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': [list(stack) for stack in samples],
+                'weights': weights,
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': profiles,
+            'name': name,
+            'activeProfileIndex': 0,
+            'exporter': 'order-processing-profiler',
+        }
+
+    def to_folded(self):
+        """
+        导出 flamegraph.pl 使用的折叠栈格式,权重单位为微秒,每个调用栈以线程名为根。
+        """
+        names = {index: f"{func_name} ({os.path.basename(file)}:{line})"
+                 for (func_name, file, line), index in self.frames.items()}
+        lines = []
+        for thread_id in self._thread_order():
+            thread_name = self.thread_names[thread_id]
+            for stack, weight in self.stacks[thread_id].items():
+                micros = int(weight * 1_000_000)
+                if micros > 0:
+                    lines.append(';'.join([thread_name] + [names[index] for index in stack]) + f" {micros}")
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profile_run(name, mode='wall', interval=DEFAULT_INTERVAL):
+    """
+    对代码块进行采样分析,结束后把结果写入 profiles 目录。
+
+    写出 <name>_<时间戳>_<mode>.speedscope.json(可在 speedscope.app 打开)
+    和同名的 .folded 文件(可用 flamegraph.pl 生成 SVG)。
+
+    Args:
+        name (str): 分析结果的名称,用作文件名前缀。
+        mode (str): wall 统计真实耗时, cpu 只统计 CPU 时间。
+        interval (float): 采样间隔(秒)。
+    """
+    if mode == 'cpu' and not hasattr(time, 'pthread_getcpuclockid'):
+        logging.warning("当前平台不支持按线程统计 CPU 时间，改用 wall 模式")
+        mode = 'wall'
+    sampler = StackSampler(threading.get_ident(), mode, interval)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+        try:
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            base_path = os.path.join(PROFILES_DIR, f"{name}_{timestamp}_{mode}")
+            with open(f"{base_path}.speedscope.json", 'w', encoding='utf-8') as f:
+                json.dump(sampler.to_speedscope(name), f, ensure_ascii=False)
+            with open(f"{base_path}.folded", 'w', encoding='utf-8') as f:
+                f.write(sampler.to_folded())
+            logging.info(f"性能分析完成: {name} 耗时 {elapsed:.2f} 秒，结果已写入 {base_path}.*")
+        except Exception as e:
+            logging.error(f"写入性能分析结果时出错：{str(e)}")
+
+
+def list_profiles():
+    """
+    列出 profiles 目录中的分析结果文件,按修改时间倒序。
+    """
+    if not os.path.exists(PROFILES_DIR):
+        return []
+    files = []
+    for filename in os.listdir(PROFILES_DIR):
+        path = os.path.join(PROFILES_DIR, filename)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files.append({
+                'filename': filename,
+                'size': stat.st_size,
+                'modified_at': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            })
+    files.sort(key=lambda item: item['modified_at'], reverse=True)
+    return files
@@ -0,0 +1,65 @@
+# progress.py
+# 这个文件提供进度上报层,对高频的进度回调进行限流与合并,避免逐行推送刷屏
+import sys
+import threading
+import time
+
+
+class ThrottledProgress:
+    """
+    对进度回调进行限流与合并的包装器。
+
+    每秒最多转发 max_per_second 次更新,期间到达的中间更新只保留最新一条;
+    第一次更新和完成更新(进度 >= 100)总是立即转发。
+    实例本身可调用,签名与原来的 progress_callback(progress, message) 一致。
+
+    Args:
+        emit (callable): 真正发送进度的函数,签名为 emit(progress, message)。
+        max_per_second (float): 每秒最多发送的更新次数,默认为 4。
+    """
+
+    def __init__(self, emit, max_per_second: float = 4):
+        self._emit = emit
+        self._min_interval = 1.0 / max_per_second if max_per_second > 0 else 0
+        self._last_sent = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def __call__(self, progress, message):
+        now = time.monotonic()
+        with self._lock:
+            is_final = progress >= 100
+            due = self._last_sent is None or now - self._last_sent >= self._min_interval
+            if not (is_final or due):
+                # 限流窗口内只保留最新的进度,等下一次到期或 flush 时发送
+                self._pending = (progress, message)
+                return
+            self._pending = None
+            self._last_sent = now
+        self._emit(progress, message)
+
+    def flush(self):
+        """
+        发送被合并掉、尚未发出的最后一条进度(如果有)。
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = None
+            if pending:
+                self._last_sent = time.monotonic()
+        if pending:
+            self._emit(*pending)
+
+
+def console_progress(label, max_per_second: float = 1):
+    """
+    创建把进度输出到标准错误的回调,供命令行等非 Web 场景使用。
+
+    Args:
+        label (str): 输出时每行前缀的标签,如文件名或阶段名。
+        max_per_second (float): 每秒最多输出的行数。
+    """
+    def emit(progress, message):
+        print(f"[{label}] {progress:5.1f}% {message}", file=sys.stderr, flush=True)
+
+    return ThrottledProgress(emit, max_per_second)
@@ -0,0 +1,124 @@
+# search.py
+# 这个文件实现了订单全文搜索,根据数据库类型使用 MySQL FULLTEXT 或 SQLite FTS5 索引
+import re
+
+from sqlalchemy import text, or_
+
+from database import engine
+from models import Order
+
+# 全文检索语法中的特殊字符,搜索前从关键词中去掉
+FULLTEXT_SPECIAL_CHARS = re.compile(r'[+\-><()~*"@\'\\]')
+
+
+def split_search_terms(query_text):
+    """
+    将搜索字符串按空白拆分为关键词,并去掉全文检索语法中的特殊字符。
+    """
+    terms = [FULLTEXT_SPECIAL_CHARS.sub('', term) for term in query_text.split()]
+    return [term for term in terms if term]
+
+
+def like_condition(term):
+    return or_(Order.original_text.contains(term, autoescape=True),
+               Order.requirements.contains(term, autoescape=True))
+
+
+def fulltext_filter(query, terms):
+    """
+    为查询添加全文检索条件,多个关键词之间为"与"的关系。
+    """
+    dialect = engine.dialect.name
+    if dialect == 'mysql':
+        # ngram 分词在布尔模式下会把每个关键词当作短语匹配
+        against = ' '.join(f'+"{term}"' for term in terms)
+        return query.filter(
+            text("MATCH (orders.original_text, orders.requirements) AGAINST (:against IN BOOLEAN MODE)")
+        ).params(against=against)
+
+    if dialect == 'sqlite':
+        # trigram 分词只能匹配至少三个字符的关键词,更短的关键词退回 LIKE
+        long_terms = [term for term in terms if len(term) >= 3]
+        if long_terms:
+            match = ' '.join(f'"{term}"' for term in long_terms)
+            query = query.filter(
+                text("orders.id IN (SELECT rowid FROM orders_fts WHERE orders_fts MATCH :match)")
+            ).params(match=match)
+        for term in terms:
+            if len(term) < 3:
+                query = query.filter(like_condition(term))
+        return query
+
+    for term in terms:
+        query = query.filter(like_condition(term))
+    return query
+
+
+def search_orders(query_text='', batch_id=None, subject=None, teacher_gender=None,
+                  subject_code=None, gender_code=None, min_price=None, max_price=None, time_slots=None,
+                  page=1, per_page=20):
+    """
+    在订单原文和要求中搜索关键词,并可按批次、文本字段和类型化字段过滤。
+
+    Args:
+        query_text (str): 搜索关键词,多个关键词用空格分隔。
+        batch_id (str): 只搜索该批次的订单。
+        subject (str): 科目包含该文本的订单。
+        teacher_gender (str): 老师性别要求等于该值的订单。
+        subject_code (str): 科目编码,见 normalize.SUBJECT_KEYWORDS。
+        gender_code (int): 老师性别要求编码,见 normalize.gender_code。
+        min_price (float): 每小时价格下限。
+        max_price (float): 每小时价格上限。
+        time_slots (int): 时间段掩码,返回上课时间与之有交集的订单,见 normalize.time_slot_mask。
+        page (int): 页码,从 1 开始。
+        per_page (int): 每页数量。
+
+    Returns:
+        tuple: (符合条件的订单总数, 当前页的订单列表)。
+    """
+    query = Order.query
+    terms = split_search_terms(query_text or '')
+    if terms:
+        query = fulltext_filter(query, terms)
+    if batch_id:
+        query = query.filter(Order.batch_id == batch_id)
+    if subject:
+        query = query.filter(Order.subject.contains(subject, autoescape=True))
+    if teacher_gender:
+        query = query.filter(Order.teacher_gender == teacher_gender)
+    if subject_code:
+        query = query.filter(Order.subject_code == subject_code)
+    if gender_code is not None:
+        query = query.filter(Order.gender_code == gender_code)
+    if min_price is not None:
+        query = query.filter(Order.price_per_hour >= min_price)
+    if max_price is not None:
+        query = query.filter(Order.price_per_hour <= max_price)
+    if time_slots:
+        query = query.filter(Order.time_slots.op('&')(time_slots) != 0)
+
+    total = query.count()
+    orders = query.order_by(Order.id.desc()) \
+                  .offset((page - 1) * per_page) \
+                  .limit(per_page) \
+                  .all()
+    return total, orders
+
+
+def order_to_dict(order):
+    return {
+        'id': order.id,
+        'batch_id': order.batch_id,
+        'address': order.address,
+        'subject': order.subject,
+        'tutoring_time': order.tutoring_time,
+        'requirements': order.requirements,
+        'price': order.price,
+        'price_per_hour': order.price_per_hour,
+        'subject_code': order.subject_code,
+        'teacher_gender': order.teacher_gender,
+        'gender_code': order.gender_code,
+        'time_slots': order.time_slots,
+        'student_info': order.student_info,
+        'original_text': order.original_text,
+    }
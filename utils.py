@@ -4,6 +4,9 @@
 import requests
 from models import Order
 from database import db_session
+from normalize import apply_typed_fields
+from batches import record_batch_created, apply_batch_deltas, new_deltas, record_parse_result
+from commute_cache import load_fresh_results, save_results
 import os
 import math
 from typing import List
@@ -12,16 +15,15 @@ from openai import OpenAI
 from dotenv import load_dotenv
 from datetime import datetime
 import json
-from sqlalchemy import func, or_
+from sqlalchemy import func, or_, case
 import pandas as pd
-from tkinter import Tk, filedialog
-import os
-import tkinter as tk
 from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
 import openpyxl
 import traceback
 import time
+import uuid
+import hashlib
 
 # 加载环境变量
 load_dotenv()
@@ -77,23 +79,19 @@ def parse_orders():
         logging.info(f"找到 {len(unprocessed_orders)} 个未解析的订单")
 
         parsed_count = 0
+        batch_deltas = new_deltas()
         for order in unprocessed_orders:
             parsed_data = parse_order_with_api(order.original_text)
             
             if parsed_data:  # 只有在成功解析时才更新订单信息
-                order.address = parsed_data.get('地址', '')
-                order.subject = parsed_data.get('科目', '')
-                order.tutoring_time = parsed_data.get('上课时间', '')
-                order.requirements = parsed_data.get('要求', '')
-                order.price = parsed_data.get('价格', '')
-                order.teacher_gender = parsed_data.get('老师性别', '')
-                order.student_info = parsed_data.get('学生情况', '')
-                
+                apply_parsed_fields(order, parsed_data)
                 db_session.add(order)
+            if record_parse_result(batch_deltas, order):
                 parsed_count += 1
             else:
                 logging.warning(f"订单 {order.id} 解析失败")
 
+        apply_batch_deltas(batch_deltas)
         db_session.commit()
         logging.info(f"成功解析并更新 {parsed_count} 个订单")
         return parsed_count
@@ -102,6 +100,23 @@ def parse_orders():
         logging.error(f"解析订单时发生错误：{str(e)}")
         raise
 
+def apply_parsed_fields(order, parsed_data):
+    """
+    将 API 解析结果写入订单的文本字段，并同步计算类型化字段。
+
+    Args:
+        order (Order): 需要更新的订单。
+        parsed_data (dict): parse_order_with_api 返回的解析结果。
+    """
+    order.address = parsed_data.get('地址', '')
+    order.subject = parsed_data.get('科目', '')
+    order.tutoring_time = parsed_data.get('上课时间', '')
+    order.requirements = parsed_data.get('要求', '')
+    order.price = parsed_data.get('价格', '')
+    order.teacher_gender = parsed_data.get('老师性别', '')
+    order.student_info = parsed_data.get('学生情况', '')
+    apply_typed_fields(order)
+
 def parse_order_with_api(order_text):
     """
     使用 DeepSeek API 解析单个订单。
@@ -154,22 +169,29 @@ def parse_order_with_api(order_text):
         logging.error(f"调用 DeepSeek API 解析订单时发生错误：{str(e)}")
         return {}
 
-def export_to_excel(data):
+def export_to_excel(data, prefix="orders_export", file_format="xlsx"):
     """
-    将解析后的订单结果导出为 Excel 文件。
+    将解析后的订单结果导出为 Excel 文件，也可以导出为 Parquet 或 CSV 文件。
+
+    Excel 只适合作为最终给人看的格式；需要再次读入程序处理（如计算通勤时间）时，
+    使用 Parquet 或 CSV 读写都快得多。
 
     Args:
         data (list): 包含订单数据的列表。
+        prefix (str): 导出文件名的前缀，默认为 orders_export。
+        file_format (str): 导出格式，xlsx、parquet 或 csv，默认为 xlsx。
 
     Returns:
-        str: 导出的 Excel 文件名。
+        str: 导出的文件名。
     """
     try:
+        if file_format not in TABLE_FORMATS:
+            raise ValueError(f"不支持的导出格式: {file_format}")
         df = pd.DataFrame(data)
         
         # 生成文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"orders_export_{timestamp}.xlsx"
+        filename = f"{prefix}_{timestamp}.{file_format}"
         
         # 确保 exports 目录存在
         exports_dir = os.path.join(os.getcwd(), 'exports')
@@ -178,8 +200,8 @@ def export_to_excel(data):
         # 构建完整的文件路径
         file_path = os.path.join(exports_dir, filename)
         
-        # 导出到 Excel
-        df.to_excel(file_path, index=False)
+        # 导出到文件
+        write_table(df, file_path)
         
         logging.info(f"成功导出 {len(data)} 个订单到 {file_path}")
         return filename  # 只返回文件名,不返回完整路径
@@ -187,19 +209,81 @@ def export_to_excel(data):
         logging.error(f"导出订单到 Excel 时发生错误：{str(e)}")
         raise
 
-def allowed_file(filename):
+TABLE_FORMATS = ('xlsx', 'parquet', 'csv')
+
+def table_format(file_path):
+    """
+    根据扩展名判断表格文件格式，.xls 按 xlsx 处理。
+    """
+    ext = file_path.rsplit('.', 1)[-1].lower()
+    if ext in ('xlsx', 'xls'):
+        return 'xlsx'
+    if ext in ('parquet', 'csv'):
+        return ext
+    raise ValueError(f"不支持的表格文件格式: {file_path}")
+
+def table_columns(file_path):
+    """
+    只读取表头，返回表格文件的列名列表。
+    """
+    file_format = table_format(file_path)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(file_path).names
+    if file_format == 'csv':
+        return pd.read_csv(file_path, nrows=0, encoding='utf-8-sig').columns.tolist()
+    return pd.read_excel(file_path, engine='openpyxl', nrows=0).columns.tolist()
+
+def read_table(file_path, columns=None):
+    """
+    读取 xlsx / parquet / csv 表格文件。
+
+    Args:
+        file_path (str): 文件路径。
+        columns (list): 只读取这些列，为 None 时读取全部列。Parquet 和 CSV 只解析所需的列。
+
+    Returns:
+        pd.DataFrame: 表格数据。
+    """
+    file_format = table_format(file_path)
+    if file_format == 'parquet':
+        return pd.read_parquet(file_path, columns=columns)
+    if file_format == 'csv':
+        return pd.read_csv(file_path, usecols=columns, encoding='utf-8-sig')
+    df = read_excel_file(file_path)
+    return df[columns] if columns else df
+
+def write_table(df, file_path):
+    """
+    按扩展名把 DataFrame 写入 xlsx / parquet / csv 文件。
+    CSV 带 BOM 写出，便于直接用 Excel 打开中文内容。
+    """
+    file_format = table_format(file_path)
+    if file_format == 'parquet':
+        df.to_parquet(file_path, index=False)
+    elif file_format == 'csv':
+        df.to_csv(file_path, index=False, encoding='utf-8-sig')
+    else:
+        df.to_excel(file_path, index=False)
+
+# 订单文件只支持 Word,老师信息和通勤计算的输入支持各种表格格式
+ORDER_FILE_EXTENSIONS = {'docx'}
+TABLE_FILE_EXTENSIONS = {'xlsx', 'xls', 'csv', 'parquet'}
+
+def allowed_file(filename, extensions=None):
     """
     检查文件是否是允许的类型。
 
     Args:
         filename (str): 文件名。
+        extensions (set): 允许的扩展名，默认为订单文件和表格文件的全部扩展名。
 
     Returns:
         bool: 如果是允许的文件类型则返回 True，否则返回 False。
     """
-    ALLOWED_EXTENSIONS = {'doc', 'docx', 'xlsx', 'xls'}
+    allowed_extensions = extensions or (ORDER_FILE_EXTENSIONS | TABLE_FILE_EXTENSIONS)
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+           filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 def split_orders(input_data: str, max_chars: int = 4000) -> List[str]:
     """
@@ -322,18 +406,57 @@ def save_to_database(orders_list):
                 price='',
                 teacher_gender='',
                 student_info='',
-                order_number=''
+                order_number='',
+                parse_failed=False,
+                text_hash=order_text_hash(order_text)
                 # 暂时注释掉 created_at 字段
                 # created_at=datetime.now()
             )
             db_session.add(order)
+        if orders_list:
+            record_batch_created(batch_id, len(orders_list))
         db_session.commit()
         logging.info(f"成功保存 {len(orders_list)} 个订单到数据库，批次ID：{batch_id}")
+        return batch_id
     except Exception as e:
         db_session.rollback()
         logging.error(f"保存订单到数据库时出错：{str(e)}")
         raise
 
+def order_text_hash(order_text: str) -> str:
+    """
+    计算订单原始文本的哈希值，用于按索引快速查找重复订单。
+    """
+    return hashlib.sha256(order_text.encode('utf-8')).hexdigest()
+
+def backfill_text_hashes(batch_size: int = 1000) -> int:
+    """
+    为缺少哈希值的旧订单补全 text_hash，按主键分段提交。
+
+    Returns:
+        int: 更新的订单数量。
+    """
+    updated = 0
+    try:
+        while True:
+            orders = Order.query.filter(Order.text_hash == None) \
+                                .order_by(Order.id) \
+                                .limit(batch_size) \
+                                .all()
+            if not orders:
+                break
+            for order in orders:
+                order.text_hash = order_text_hash(order.original_text or '')
+            db_session.commit()
+            updated += len(orders)
+        if updated:
+            logging.info(f"成功补全 {updated} 个订单的文本哈希")
+        return updated
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"补全订单文本哈希时出错：{str(e)}")
+        raise
+
 def log_order_processing(num_batches: int):
     """
     记录订单处理的日志信息。
@@ -352,8 +475,8 @@ def generate_batch_id() -> str:
     Returns:
         str: 生成的批次 ID。
     """
-    # 使用时间戳生唯一的批次 ID
-    return datetime.now().strftime('%m%d%H%M%S')
+    # 使用时间戳保证可读性，附加随机后缀避免同一秒内的并发运行生成相同的批次 ID
+    return f"{datetime.now().strftime('%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
 
 def remove_duplicates(progress_callback):
     """
@@ -375,11 +498,23 @@ def remove_duplicates(progress_callback):
             return 0
 
         # 查找重复的订单
-        duplicates = db_session.query(
+        duplicates_query = db_session.query(
             Order.original_text,
             func.count(Order.id).label('count'),
             func.max(Order.id).label('max_id')
-        ).group_by(Order.original_text).having(func.count(Order.id) > 1).all()
+        ).group_by(Order.original_text).having(func.count(Order.id) > 1)
+        duplicates = duplicates_query.all()
+
+        # 按批次统计将被删除的订单，用于在同一事务中更新批次汇总
+        groups = duplicates_query.subquery()
+        removed_by_batch = db_session.query(
+            Order.batch_id,
+            func.count(Order.id),
+            func.sum(case((Order.address != '', 1), else_=0)),
+            func.sum(case((Order.parse_failed == True, 1), else_=0))
+        ).join(groups, Order.original_text == groups.c.original_text) \
+         .filter(Order.id != groups.c.max_id) \
+         .group_by(Order.batch_id).all()
 
         logging.info(f"找到 {len(duplicates)} ��重复订单")
 
@@ -398,6 +533,13 @@ def remove_duplicates(progress_callback):
             progress = (i + 1) / total_duplicates * 100 if total_duplicates > 0 else 100
             progress_callback(progress, f"已处理 {i + 1}/{total_duplicates} 组重复订单")
 
+        batch_deltas = new_deltas()
+        for batch_id, removed, parsed, failed in removed_by_batch:
+            batch_deltas[batch_id]['total'] -= removed
+            batch_deltas[batch_id]['parsed'] -= int(parsed or 0)
+            batch_deltas[batch_id]['failed'] -= int(failed or 0)
+            batch_deltas[batch_id]['duplicate'] += removed
+        apply_batch_deltas(batch_deltas)
         db_session.commit()
         logging.info(f"成功删除 {total_removed} 个重复订单")
         return total_removed
@@ -406,34 +548,42 @@ def remove_duplicates(progress_callback):
         logging.error(f"删除重复订单时发生错误：{str(e)}")
         raise
 
-def parse_and_export_orders(progress_callback):
+def parse_pending_orders(progress_callback, batch_id=None, progress_span=100):
     """
-    解析数据库中尚未解析的订单,并同时导出为Excel文件。
+    解析数据库中尚未解析的订单，返回用于导出的订单数据。
+
+    Args:
+        progress_callback (callable): 进度回调。
+        batch_id (str): 只解析该批次的订单,为 None 时解析所有批次。
+        progress_span (float): 解析完成时上报的进度值。
+
+    Returns:
+        list: 解析成功的订单数据，每个元素是一条用于导出的字典。
     """
     try:
-        unprocessed_orders = Order.query.filter(or_(
+        query = Order.query.filter(or_(
             Order.address == '',
             Order.address == None
-        )).all()
+        ))
+        if batch_id:
+            query = query.filter(Order.batch_id == batch_id)
+        unprocessed_orders = query.all()
         
         total_orders = len(unprocessed_orders)
         logging.info(f"找 {total_orders} 个未解析的订单")
 
         parsed_data = []
+        batch_deltas = new_deltas()
         for i, order in enumerate(unprocessed_orders):
             parsed_order = parse_order_with_api(order.original_text)
             
             if parsed_order:  # 只有在成功解析时才更新订单信息
-                order.address = parsed_order.get('地址', '')
-                order.subject = parsed_order.get('科目', '')
-                order.tutoring_time = parsed_order.get('上课时间', '')
-                order.requirements = parsed_order.get('要求', '')
-                order.price = parsed_order.get('价格', '')
-                order.teacher_gender = parsed_order.get('老师性别', '')
-                order.student_info = parsed_order.get('学生情况', '')
-                
+                apply_parsed_fields(order, parsed_order)
                 db_session.add(order)
+            # 解析结果中没有地址的订单仍留在未解析集合中,按失败计
+            if record_parse_result(batch_deltas, order):
                 parsed_data.append({
+                    '订单ID': order.id,
                     '地址': order.address,
                     '科目': order.subject,
                     '上课时间': order.tutoring_time,
@@ -446,25 +596,38 @@ def parse_and_export_orders(progress_callback):
             else:
                 logging.warning(f" {order.id} 析失败")
             
-            progress = (i + 1) / total_orders * 90  # 解析占90%的进度
+            progress = (i + 1) / total_orders * progress_span
             progress_callback(progress, f"已解析 {i + 1}/{total_orders} 个订单")
 
+        apply_batch_deltas(batch_deltas)
         db_session.commit()
         logging.info(f"成功解析并更新 {len(parsed_data)} 个订单")
-
-        if parsed_data:
-            progress_callback(95, "正在导出到Excel...")
-            file_path = export_to_excel(parsed_data)
-            progress_callback(100, "导出完成")
-            return len(parsed_data), file_path
-        else:
-            return 0, None
+        return parsed_data
 
     except Exception as e:
         db_session.rollback()
         logging.error(f"解析订单时生错误：{str(e)}")
         raise
 
+def parse_and_export_orders(progress_callback, batch_id=None, file_format="xlsx"):
+    """
+    解析数据库中尚未解析的订单,并同时导出为Excel文件。
+
+    Args:
+        progress_callback (callable): 进度回调。
+        batch_id (str): 只解析该批次的订单,为 None 时解析所有批次。
+        file_format (str): 导出格式,xlsx、parquet 或 csv。
+    """
+    parsed_data = parse_pending_orders(progress_callback, batch_id, progress_span=90)  # 解析占90%的进度
+
+    if parsed_data:
+        progress_callback(95, "正在导出到Excel...")
+        file_path = export_to_excel(parsed_data, file_format=file_format)
+        progress_callback(100, "导出完成")
+        return len(parsed_data), file_path
+    else:
+        return 0, None
+
 def read_excel_file(file_path):
     """
     读取Excel文件并返回DataFrame。
@@ -510,81 +673,178 @@ def geocode_baidu(address):
         logging.error(f"地址 '{address}' 解析时发生错误: {str(e)}")
         return None
 
-def calculate_commute_times(excel_file, target_address, progress_callback):
+COMMUTE_MODE_NAMES = {
+    'riding': '骑行',
+    'transit': '公交/地铁'
+}
+# 新计算的通勤结果每累计这么多条写入一次缓存
+COMMUTE_SAVE_EVERY = 50
+
+def format_commute(durations):
+    """
+    把各交通方式的通勤分钟数转换为表格中的 (通勤时间, 交通方式) 文本。
+    """
+    commute_time, commute_mode = best_commute(durations)
+    if commute_time == float('inf'):
+        return ('无法获取', '未知')
+    return (f"{commute_time:.0f}分钟", COMMUTE_MODE_NAMES.get(commute_mode, commute_mode))
+
+def cache_commute_results(new_results):
+    """
+    把新计算的通勤结果写入缓存。写入失败只影响下次能否复用,不中断本次计算。
+    """
+    try:
+        save_results(new_results)
+    except Exception as e:
+        logging.warning(f"写入通勤缓存失败: {str(e)}")
+
+def geocode_with_retry(address, max_retries=3):
+    """
+    解析地址坐标,失败时最多重试 max_retries 次。
+
+    Returns:
+        tuple: (坐标, 错误信息)。成功时错误信息为 None;无法解析时坐标为 None。
+    """
+    for retry_count in range(1, max_retries + 1):
+        try:
+            coords = geocode_baidu(address)
+            if coords:
+                return coords, None
+            if retry_count == max_retries:
+                logging.warning(f"无法解析地址 (已重试{max_retries}次): {address}")
+                return None, '地址无法解析'
+            logging.info(f"重试解析地址 ({retry_count}/{max_retries}): {address}")
+        except Exception as e:
+            if retry_count == max_retries:
+                logging.error(f"处理地址 '{address}' 时发生错误 (已重试{max_retries}次): {str(e)}")
+                logging.error(traceback.format_exc())
+                return None, f'错误: {str(e)}'
+            logging.info(f"重试处理地址 ({retry_count}/{max_retries}): {address}")
+        time.sleep(1)  # 等待1秒后重试
+    return None, '地址无法解析'
+
+def commute_column_names(target_address, multiple_targets):
+    """
+    返回某个目标地址对应的(通勤时间列, 交通方式列)列名。
+    只有一个目标地址时沿用原来的列名,多个目标时在列名后附加目标地址。
+    """
+    if not multiple_targets:
+        return '通勤时间', '交通方式'
+    return f'通勤时间({target_address})', f'交通方式({target_address})'
+
+def calculate_commute_times(excel_file, target_addresses, progress_callback, output_format=None, incremental=False):
+    """
+    计算导出文件中每个订单地址到一个或多个目标地址的通勤时间。
+
+    每个不同的订单地址只解析一次坐标,到所有目标地址的路线一起计算,
+    骑行路线通过批量算路接口一次请求完成。输入为 Parquet 或 CSV 时,
+    计算阶段只读取 地址 和 订单ID 两列,完整表格在写出结果时才读取。
+
+    Args:
+        excel_file (str): 导出的订单文件路径,支持 xlsx、parquet、csv。
+        target_addresses (str | list): 目标地址,或目标地址列表。
+        progress_callback (callable): 进度回调。
+        output_format (str): 输出格式,xlsx、parquet 或 csv,默认与输入文件相同。
+        incremental (bool): 是否复用 commute_results 中未过期的结果,只计算新的地址和目标组合。
+
+    Returns:
+        str: 生成的文件的完整路径。
+    """
     check_baidu_api_key()
+    if isinstance(target_addresses, str):
+        target_addresses = [target_addresses]
     logging.info(f"开始处理文件: {excel_file}")
-    logging.info(f"目标地址: {target_address}")
+    logging.info(f"目标地址: {target_addresses}")
 
     try:
-        df = read_excel_file(excel_file)
-        logging.info(f"成功读取Excel文件，共 {len(df)} 行数据")
-        logging.info(f"列名: {df.columns.tolist()}")
+        input_format = table_format(excel_file)
+        output_format = output_format or input_format
+        if output_format not in TABLE_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output_format}")
+
+        # Excel 无法按列读取,整表只解析一次,表头直接取自读入的数据;
+        # Parquet 和 CSV 先只读表头,计算阶段只读取地址列和行键
+        if input_format == 'xlsx':
+            full_df = read_table(excel_file)
+            columns = full_df.columns.tolist()
+        else:
+            full_df = None
+            columns = table_columns(excel_file)
+        logging.info(f"列名: {columns}")
         
         required_columns = ['地址', '科目', '上课时间', '要求', '价格', '老师性别', '学生情况', '原始订单']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        missing_columns = [col for col in required_columns if col not in columns]
         if missing_columns:
-            raise ValueError(f"Excel文件缺少以下必要的列: {', '.join(missing_columns)}")
-        
-        target_coords = geocode_baidu(target_address)
-        if not target_coords:
-            raise ValueError("无法获取目标地址的坐标")
-        logging.info(f"目标地址坐标: {target_coords}")
-        
-        df['通勤时间'] = ''
-        df['交通方式'] = ''
-        
-        total_rows = len(df)
-        for index, row in df.iterrows():
-            address = row['地址']
-            retry_count = 0
-            max_retries = 3
+            raise ValueError(f"文件缺少以下必要的列: {', '.join(missing_columns)}")
 
-            while retry_count < max_retries:
-                try:
-                    coords = geocode_baidu(address)
-                    if coords:
-                        commute_time, commute_mode = get_baidu_commute_time(coords, target_coords)
-                        
-                        if commute_time != float('inf'):
-                            df.at[index, '通勤时间'] = f"{commute_time:.0f}分钟"
-                            df.at[index, '交通方式'] = {
-                                'riding': '骑行',
-                                'transit': '公交/地铁'
-                            }.get(commute_mode, commute_mode)
-                        else:
-                            df.at[index, '通勤时间'] = '无法获取'
-                            df.at[index, '交通方式'] = '未知'
-                        
-                        logging.info(f"地址 '{address}' 的通勤时间: {df.at[index, '通勤时间']}，方式: {df.at[index, '交通方式']}")
-                        break  # 成功处理，跳出重试循环
-                    else:
-                        retry_count += 1
-                        if retry_count == max_retries:
-                            df.at[index, '通勤时间'] = '地址无法解析'
-                            df.at[index, '交通方式'] = '未知'
-                            logging.warning(f"无法解析地址 (已重试{max_retries}次): {address}")
-                        else:
-                            logging.info(f"重试解析地址 ({retry_count}/{max_retries}): {address}")
-                            time.sleep(1)  # 等待1秒后重试
-                except Exception as e:
-                    retry_count += 1
-                    if retry_count == max_retries:
-                        df.at[index, '通勤时间'] = f'错误: {str(e)}'
-                        df.at[index, '交通方式'] = '未知'
-                        logging.error(f"处理地址 '{address}' 时发生错误 (已重试{max_retries}次): {str(e)}")
+        key_columns = ['地址'] + (['订单ID'] if '订单ID' in columns else [])
+        df = full_df[key_columns] if full_df is not None else read_table(excel_file, key_columns)
+        logging.info(f"成功读取文件，共 {len(df)} 行数据")
+        
+        # 相同的订单地址只计算一次,结果按地址复用到所有行
+        addresses = df['地址'].fillna('').astype(str)
+        unique_addresses = addresses.unique()
+        cached = load_fresh_results(unique_addresses, target_addresses) if incremental else {}
+        missing = {address: [target for target in target_addresses if (address, target) not in cached]
+                   for address in unique_addresses}
+
+        # 只对还有组合需要计算的目标地址做地理编码
+        target_coords = {}
+        for target_address in target_addresses:
+            if not any(target_address in targets for targets in missing.values()):
+                continue
+            coords = geocode_baidu(target_address)
+            if not coords:
+                raise ValueError(f"无法获取目标地址的坐标: {target_address}")
+            logging.info(f"目标地址 '{target_address}' 坐标: {coords}")
+            target_coords[target_address] = coords
+
+        results = {}
+        new_results = []
+        total_addresses = len(unique_addresses)
+        for i, address in enumerate(unique_addresses):
+            results[address] = {target: format_commute(cached[(address, target)])
+                                for target in target_addresses if (address, target) in cached}
+            targets = missing[address]
+            if targets:
+                coords, error = geocode_with_retry(address)
+                if coords:
+                    try:
+                        route_durations = get_baidu_route_durations(coords, [target_coords[t] for t in targets])
+                        for target, durations in zip(targets, route_durations):
+                            results[address][target] = format_commute(durations)
+                            new_results.append((address, target, durations))
+                    except Exception as e:
+                        logging.error(f"计算地址 '{address}' 的通勤时间时发生错误: {str(e)}")
                         logging.error(traceback.format_exc())
-                    else:
-                        logging.info(f"重试处理地址 ({retry_count}/{max_retries}): {address}")
-                        time.sleep(1)  # 等待1秒后重试
-
-            progress = (index + 1) / total_rows * 100
-            progress_callback(progress, f"已处理 {index + 1}/{total_rows} 个地址")
+                        for target in targets:
+                            results[address][target] = (f'错误: {str(e)}', '未知')
+                    logging.info(f"地址 '{address}' 的通勤结果: {results[address]}")
+                else:
+                    for target in targets:
+                        results[address][target] = (error, '未知')
+
+            if len(new_results) >= COMMUTE_SAVE_EVERY:
+                cache_commute_results(new_results)
+                new_results = []
+            progress = (i + 1) / total_addresses * 100
+            progress_callback(progress, f"已处理 {i + 1}/{total_addresses} 个地址")
+        cache_commute_results(new_results)
+
+        # 两次读取的行顺序一致,按位置把通勤结果合并回完整表格
+        if full_df is None:
+            full_df = read_table(excel_file)
+        multiple_targets = len(target_addresses) > 1
+        for target_address in target_addresses:
+            time_column, mode_column = commute_column_names(target_address, multiple_targets)
+            full_df[time_column] = addresses.map(lambda address: results[address][target_address][0]).to_numpy()
+            full_df[mode_column] = addresses.map(lambda address: results[address][target_address][1]).to_numpy()
         
         exports_dir = os.path.join(os.getcwd(), 'exports')
-        output_filename = f"orders_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}_with_commute_times.xlsx"
+        output_filename = f"orders_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}_with_commute_times.{output_format}"
         output_file = os.path.join(exports_dir, output_filename)
-        df.to_excel(output_file, index=False)
-        logging.info(f"尝试生成包含通勤时间的Excel文件: {output_file}")
+        write_table(full_df, output_file)
+        logging.info(f"尝试生成包含通勤时间的文件: {output_file}")
         
         if os.path.exists(output_file):
             file_size = os.path.getsize(output_file)
@@ -600,17 +860,69 @@ def calculate_commute_times(excel_file, target_address, progress_callback):
         raise
 
 def get_baidu_commute_time(origin, destination):
+    return get_baidu_commute_times(origin, [destination])[0]
+
+def best_commute(durations):
+    """
+    从各交通方式的通勤分钟数中选出最短的一种。
+
+    Returns:
+        tuple: (通勤分钟数, 交通方式)，都不可用时为 (inf, None)。
+    """
+    best_time, best_mode = float('inf'), None
+    for mode in ('riding', 'transit'):
+        duration = durations.get(mode)
+        if duration is not None and duration < best_time:
+            best_time, best_mode = duration, mode
+    return best_time, best_mode
+
+def get_baidu_commute_times(origin, destinations):
+    """
+    计算一个起点到多个终点的最短通勤时间。
+
+    Returns:
+        list: 与 destinations 一一对应的 (通勤分钟数, 交通方式) 列表。
+    """
+    return [best_commute(durations) for durations in get_baidu_route_durations(origin, destinations)]
+
+def get_baidu_route_durations(origin, destinations):
+    """
+    计算一个起点到多个终点各交通方式的通勤时间。
+
+    5公里以内的终点用批量算路接口一次请求得到全部骑行时间,
+    公交/地铁路线没有批量接口,逐个终点请求。
+
+    Returns:
+        list: 与 destinations 一一对应的 {交通方式: 分钟数} 字典。值为 None 表示该方式不可用
+            (超出骑行距离或没有路线);接口出错时不包含该交通方式。
+    """
     ak = os.getenv('BAIDU_MAP_AK')
     if not ak:
         raise ValueError("未设置百度地图API密钥")
     
-    distance = geodesic(origin, destination).kilometers
+    durations = [{} for _ in destinations]
     
-    best_time = float('inf')
-    best_mode = None
+    nearby = []
+    for i, destination in enumerate(destinations):
+        if geodesic(origin, destination).kilometers <= 5:
+            nearby.append(i)
+        else:
+            durations[i]['riding'] = None
+    if nearby:
+        url = "http://api.map.baidu.com/routematrix/v2/riding"
+        params = {
+            "origins": f"{origin[0]},{origin[1]}",
+            "destinations": "|".join(f"{destinations[i][0]},{destinations[i][1]}" for i in nearby),
+            "ak": ak
+        }
+        response = requests.get(url, params=params)
+        data = response.json()
+        if data['status'] == 0 and 'result' in data:
+            for i, element in zip(nearby, data['result']):
+                durations[i]['riding'] = element['duration']['value'] / 60 if 'duration' in element else None
     
-    if distance <= 5:
-        url = f"http://api.map.baidu.com/directionlite/v1/riding"
+    for i, destination in enumerate(destinations):
+        url = f"http://api.map.baidu.com/directionlite/v1/transit"
         params = {
             "origin": f"{origin[0]},{origin[1]}",
             "destination": f"{destination[0]},{destination[1]}",
@@ -618,27 +930,11 @@ def get_baidu_commute_time(origin, destination):
         }
         response = requests.get(url, params=params)
         data = response.json()
-        if data['status'] == 0 and 'result' in data and 'routes' in data['result']:
-            duration = data['result']['routes'][0]['duration'] / 60
-            if duration < best_time:
-                best_time = duration
-                best_mode = 'riding'
-    
-    url = f"http://api.map.baidu.com/directionlite/v1/transit"
-    params = {
-        "origin": f"{origin[0]},{origin[1]}",
-        "destination": f"{destination[0]},{destination[1]}",
-        "ak": ak
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    if data['status'] == 0 and 'result' in data and 'routes' in data['result']:
-        duration = data['result']['routes'][0]['duration'] / 60
-        if duration < best_time:
-            best_time = duration
-            best_mode = 'transit'
+        if data['status'] == 0:
+            routes = data.get('result', {}).get('routes')
+            durations[i]['transit'] = routes[0]['duration'] / 60 if routes else None
     
-    return best_time, best_mode
+    return durations
 
 def check_baidu_api_key():
     ak = os.getenv('BAIDU_MAP_AK')